@@ -16,12 +16,23 @@ import httpx
 import requests
 
 
-from utils.search_web import Search
+from utils.search_web import Search, get_engine_cache_stats
 from utils.crawl_web import Crawl
 from utils.pages_retrieve import Retrieval_v2
 from utils.response import generate, search_generate
+from utils.keywords_extract import get_plan_cache_stats, normalize_query
 from utils.retrieval import Retrieval_v1
+from utils.retrieval_method import get_rerank_cache_stats
 from utils.config_manager import config
+from utils.latency_budget import LatencyBudget
+from utils.client_registry import clients
+from utils.embedding_cache import embedding_cache
+from utils.answer_cache import answer_cache
+from utils.single_flight import search_coalescer
+from utils.dns_cache import dns_cache
+from utils.domain_health import domain_health
+from utils.extract_pool import extraction_pool
+from utils.charset import charset_resolver
 import utils.database as db
 
 dir_path = './logs'
@@ -71,7 +82,12 @@ async def lifespan(app: FastAPI):  # type: ignore
     logger.info("数据库表已检查/创建完成。")
     config.initialize_config()
     logger.info("配置管理器已初始化。")
+    await clients.start()
+    logger.info("共享客户端已创建。")
     yield
+    await clients.close()
+    logger.info("共享客户端已关闭。")
+    extraction_pool.shutdown()
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
@@ -144,9 +160,35 @@ async def save_settings_api(payload: dict):
         return {"status": "error", "message": "未提供设置数据。"}
     db.save_settings(settings_data)
     config.load_config() # Reload config in the manager
+    await clients.rebuild() # Rebuild pooled clients with the new credentials
     is_configured_now = config.is_configured()
     return {"status": "success", "message": "设置保存成功。", "configured": is_configured_now}
 
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return {
+        "search_plan": get_plan_cache_stats(),
+        "search_engine": get_engine_cache_stats(),
+        "embedding": embedding_cache.get_stats(),
+        "rerank": get_rerank_cache_stats(),
+        "answer": answer_cache.get_stats(),
+        "coalescing": search_coalescer.get_stats(),
+        "dns": dns_cache.get_stats(),
+        "extraction": extraction_pool.get_stats(),
+        "charset": charset_resolver.get_stats(),
+    }
+
+@app.get("/api/cache/search")
+async def list_search_cache(limit: int = 100):
+    return await asyncio.to_thread(db.list_search_cache, limit)
+
+@app.delete("/api/cache/search")
+async def purge_search_cache(engine: Optional[str] = None, query: Optional[str] = None):
+    normalized_query = normalize_query(query) if query else None
+    deleted = await asyncio.to_thread(db.purge_search_cache, engine, normalized_query)
+    logger.info(f"已清除 {deleted} 条搜索缓存 (engine={engine}, query={query})")
+    return {"status": "success", "deleted": deleted}
+
 @app.post("/api/test/llm")
 async def test_llm_connection(req: TestRequest):
     if not req.api_key or not req.base_url or not req.model_name:
@@ -238,6 +280,101 @@ async def test_google_connection(req: TestRequest):
         logger.error(f"Google Search连接测试失败: {e}")
         return {"success": False, "message": f"连接失败: {str(e)}"}
 
+async def run_search_pipeline(query: str, chat_history: List[dict], budget: LatencyBudget, query_vector=None, embedding_model: str = ''):
+    """
+    联网搜索流程：规划→搜索→抓取→检索→生成，产出 (类型, 内容) 事件，助手消息由调用方保存。
+    """
+    yield ("process", "正在分析问题...")
+
+    search_instance = Search()
+    search_plan_data, search_results = await search_instance.search(query, chat_history=chat_history, budget=budget)
+
+    print(f"search_plan_data:{search_plan_data}")
+    plan = search_plan_data.get('search_plan', {}) if search_plan_data else {}
+    if not (plan.get('foundational_queries') or plan.get('expansion_deep_dive_queries')):
+        yield ("process", "该问题不需要搜索，直接回答...")
+        response_generator = budget.first_token_within(generate(query, chat_history=chat_history))
+        if response_generator:
+            async for chunk in response_generator:
+                yield ("answer_chunk", chunk.decode('utf-8', errors='ignore'))
+        return
+
+    key_entities = search_plan_data.get('query_analysis', {}).get('key_entities', [])
+    yield ("process", f"搜索关键词: {key_entities}")
+
+    retrieval_vertion = config.get("retrieval_version", "v2") # Read from config
+    logger.info(f"检索版本: {retrieval_vertion}")
+    crawler = Crawl(
+        async_client=clients.get().crawler,
+        pdf_query_pages=str(config.get('pdf_query_page_selection', 'false')).lower() == 'true',
+    )
+    try:
+        if retrieval_vertion == "v2":
+            # 网页边抓取边嵌入，查询向量与抓取并行计算
+            retrieval_v2 = Retrieval_v2()
+            try:
+                context, web_pages = await retrieval_v2.retrieve_stream(
+                    search_plan_data,
+                    list(search_results.keys()),
+                    budget.iterate('crawl', crawler.crawl_stream(search_results, after=search_instance.warm_task)),
+                    budget=budget,
+                )
+            finally:
+                retrieval_v2.close()
+            yield ("process", f"搜索完成. 找到 {sum(len(v) for v in web_pages.values())} 个网页.")
+        else:
+            web_pages = await crawler.crawl_async(search_results, budget=budget, after=search_instance.warm_task)
+            yield ("process", f"搜索完成. 找到 {sum(len(v) for v in web_pages.values())} 个网页.")
+            retrieval_v1 = Retrieval_v1()
+            all_web_pages = [page for pages in web_pages.values() for page in pages]
+            context = await budget.run(
+                'retrieval',
+                asyncio.to_thread(retrieval_v1.retrieve, queries=[query], search_plan_data=search_plan_data, web_pages=all_web_pages),
+                default=[],
+            )
+    finally:
+        await crawler.aclose()
+        if search_instance.warm_task is not None:
+            search_instance.warm_task.cancel()
+
+    assistant_response_text = ""
+    response_generator = budget.first_token_within(search_generate(query, context, search_plan_data, chat_history=chat_history))
+    if response_generator:
+        async for chunk in response_generator:
+            if isinstance(chunk, bytes):
+                chunk_str = chunk.decode('utf-8', errors='ignore')
+            else:
+                chunk_str = str(chunk) # Handle non-byte chunks
+            assistant_response_text += chunk_str
+            yield ("answer_chunk", chunk_str)
+    all_pages = []
+    if isinstance(context, dict):
+        for results in context.values():
+            all_pages.extend(results)
+    else:
+        for item in context:
+            if isinstance(item, Document):
+                all_pages.append({
+                    'title': item.metadata.get('title', ''),
+                    'link': item.metadata.get('url', '')
+                })
+            elif isinstance(item, dict):
+                all_pages.append(item)
+    unique_refs = {
+        (page.get('title'), page.get('link')): {page.get('title'): page.get('link')}
+        for page in all_pages if page.get('title') and page.get('link')
+    }
+    references = list(unique_refs.values())
+    logger.info(f"参考来源: {json.dumps(references,ensure_ascii=False,indent=2)}")
+    if references:
+        yield ("reference", references)
+    logger.info(f"请求各阶段耗时: {budget.summary()}")
+    # 有阶段超时的答案基于部分结果，不写入缓存
+    if query_vector is not None and assistant_response_text and not budget.timed_out_stages:
+        intent = search_plan_data.get('query_analysis', {}).get('identified_intent')
+        answer_cache.store(query, query_vector, embedding_model, assistant_response_text, references, intent)
+
+
 @app.post("/search")
 async def search(req: SearchRequest):
     if not config.is_configured():
@@ -259,11 +396,12 @@ async def search(req: SearchRequest):
 
     async def process_request():
         assistant_response_text = ""
+        budget = LatencyBudget.from_config()
         try:
             if not req.use_web:
-                response_generator = generate(req.query, chat_history=processed_history)
+                response_generator = budget.first_token_within(generate(req.query, chat_history=processed_history))
                 if response_generator:
-                    for chunk in response_generator:
+                    async for chunk in response_generator:
                         chunk_str = chunk.decode('utf-8', errors='ignore')
                         assistant_response_text += chunk_str
                         yield await stream_json("answer_chunk", chunk_str)
@@ -273,98 +411,40 @@ async def search(req: SearchRequest):
                 db.add_message(session_id, 'assistant', json.dumps(final_db_content, ensure_ascii=False))
                 return
             logger.info("准备搜索....")
-            yield await stream_json("process", "正在分析问题...")
-            await asyncio.sleep(0)
-
-            search_instance = Search()
-            search_plan_data, search_results = await search_instance.search(req.query, chat_history=processed_history)
-
-            print(f"search_plan_data:{search_plan_data}")
-            if not search_plan_data:
-                yield await stream_json("process", "该问题不需要搜索，直接回答...")
-                await asyncio.sleep(0)
-                response_generator = generate(req.query, chat_history=processed_history)
-                if response_generator:
-                    for chunk in response_generator:
-                        chunk_str = chunk.decode('utf-8', errors='ignore')
-                        assistant_response_text += chunk_str
-                        yield await stream_json("answer_chunk", chunk_str)
-                        await asyncio.sleep(0)
-                final_db_content = {"text": assistant_response_text, "references": []}
-                db.add_message(session_id, 'assistant', json.dumps(final_db_content, ensure_ascii=False))
-                return
-
-            plan = search_plan_data.get('search_plan', {})
-            foundational_queries = plan.get('foundational_queries', [])
-            expansion_queries = plan.get('expansion_deep_dive_queries', [])
-
-            if not (foundational_queries or expansion_queries):
-                yield await stream_json("process", "该问题不需要搜索，直接回答...")
-                await asyncio.sleep(0)
-                response_generator = generate(req.query, chat_history=processed_history)
-                if response_generator:
-                    for chunk in response_generator:
-                        chunk_str = chunk.decode('utf-8', errors='ignore')
-                        assistant_response_text += chunk_str
-                        yield await stream_json("answer_chunk", chunk_str)
-                        await asyncio.sleep(0)
-                final_db_content = {"text": assistant_response_text, "references": []}
-                db.add_message(session_id, 'assistant', json.dumps(final_db_content, ensure_ascii=False))
-                return
-
-            key_entities = search_plan_data.get('query_analysis', {}).get('key_entities', [])
-            yield await stream_json("process", f"搜索关键词: {key_entities}")
-            await asyncio.sleep(0)
-
-            crawler = Crawl()
-            web_pages = crawler.crawl(search_results)
-            crawler.close()
-
-            yield await stream_json("process", f"搜索完成. 找到 {sum(len(v) for v in web_pages.values())} 个网页.")
-            await asyncio.sleep(0)
-
-            retrieval_vertion = config.get("retrieval_version", "v2") # Read from config
-            logger.info(f"检索版本: {retrieval_vertion}")
-            if retrieval_vertion == "v2":
-                retrieval_v2 = Retrieval_v2()
-                context = retrieval_v2.retrieve(search_plan_data, web_pages)
-            else:
-                retrieval_v1 = Retrieval_v1()
-                all_web_pages = [page for pages in web_pages.values() for page in pages]
-                context = retrieval_v1.retrieve(queries=[req.query],search_plan_data=search_plan_data, web_pages=all_web_pages)
-
-
-            response_generator = search_generate(req.query, context, search_plan_data, chat_history=processed_history)
-            if response_generator:
-                for chunk in response_generator:
-                    if isinstance(chunk, bytes):
-                        chunk_str = chunk.decode('utf-8', errors='ignore')
-                    else:
-                        chunk_str = str(chunk) # Handle non-byte chunks
-                    assistant_response_text += chunk_str
-                    yield await stream_json("answer_chunk", chunk_str)
+            # 语义答案缓存只用于没有上下文的独立问题，追问的答案依赖聊天记录
+            query_vector = None
+            embedding_model = config.get('embedding_model_name') or ''
+            if not processed_history and answer_cache.is_enabled():
+                query_vector = await budget.run('answer_cache', asyncio.to_thread(Retrieval_v2().embed_query, req.query))
+                cached_answer = answer_cache.lookup(req.query, query_vector, embedding_model) if query_vector is not None else None
+                if cached_answer:
+                    yield await stream_json("process", "找到相似问题的答案，直接返回...")
+                    await asyncio.sleep(0)
+                    yield await stream_json("answer_chunk", cached_answer['answer'])
                     await asyncio.sleep(0)
-            all_pages = []
-            if isinstance(context, dict):
-                for results in context.values():
-                    all_pages.extend(results)
+                    if cached_answer['references']:
+                        yield await stream_json("reference", cached_answer['references'])
+                        await asyncio.sleep(0)
+                    final_db_content = {"text": cached_answer['answer'], "references": cached_answer['references']}
+                    db.add_message(session_id, 'assistant', json.dumps(final_db_content, ensure_ascii=False))
+                    logger.info(f"缓存答案已添加至会话 {session_id}")
+                    return
+
+            # 没有聊天记录的相同问题共用一次 规划→搜索→抓取→检索→生成 流程，各自保存消息
+            retrieval_version = config.get("retrieval_version", "v2")
+            # 合并的请求在独立任务中运行、可能比先到的请求活得更久，单独持有客户端
+            pipeline = lambda: clients.leased(run_search_pipeline(req.query, processed_history, budget, query_vector, embedding_model))
+            if not processed_history and str(config.get('search_coalescing_enabled', 'true')).lower() == 'true':
+                events = search_coalescer.subscribe(f"{retrieval_version}:{normalize_query(req.query)}", pipeline)
             else:
-                for item in context:
-                    if isinstance(item, Document):
-                        all_pages.append({
-                            'title': item.metadata.get('title', ''),
-                            'link': item.metadata.get('url', '')
-                        })
-                    elif isinstance(item, dict):
-                        all_pages.append(item)
-            unique_refs = {
-                (page.get('title'), page.get('link')): {page.get('title'): page.get('link')}
-                for page in all_pages if page.get('title') and page.get('link')
-            }
-            references = list(unique_refs.values())
-            logger.info(f"参考来源: {json.dumps(references,ensure_ascii=False,indent=2)}")
-            if references:
-                yield await stream_json("reference", references)
+                events = pipeline()
+            references = []
+            async for data_type, content in events:
+                if data_type == "answer_chunk":
+                    assistant_response_text += content
+                elif data_type == "reference":
+                    references = content
+                yield await stream_json(data_type, content)
                 await asyncio.sleep(0)
 
             final_db_content = {"text": assistant_response_text, "references": references}
@@ -376,7 +456,7 @@ async def search(req: SearchRequest):
             yield await stream_json("error", f"发生错误: {e}")
 
     return StreamingResponse(
-        process_request(), 
+        clients.leased(process_request()), 
         media_type="application/x-json-stream",
         headers={
             "Cache-Control": "no-cache, no-store, must-revalidate",
@@ -454,6 +534,12 @@ async def register(req: RegisterRequest):
     logger.info(f"用户注册成功: {req.user_id}")
     return {"message": "注册成功", "user_id": req.user_id}
 
+@app.get("/debug/domains")
+async def debug_domains(limit: int = 100):
+    """抓取器按域名统计的健康状况：p95 耗时、错误率、正文抽取失败率、付费墙/4xx 比例与熔断状态"""
+    return domain_health.snapshot(limit)
+
+
 @app.get("/debug/stream")
 async def debug_stream():
     async def gen():
@@ -0,0 +1,154 @@
+"""
+网页正文抽取基准测试：对比旧的 BeautifulSoup → readability → selectolax 多次解析流程
+与 utils/html_extract 的单次解析引擎。
+
+默认语料为仓库中固定的 benchmarks/fixtures（新闻、GBK 百科、论坛、英文文档、短页面、商品页），
+结果可以复现:
+    python benchmarks/html_extraction_benchmark.py run --repeat 3
+
+也可以录制真实网页作为补充语料（每行一个URL，页面原始字节保存到语料目录，该目录不纳入版本库）:
+    python benchmarks/html_extraction_benchmark.py record urls.txt --corpus benchmarks/corpus
+    python benchmarks/html_extraction_benchmark.py run --corpus benchmarks/corpus --repeat 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chardet
+import httpx
+from bs4 import BeautifulSoup
+from readability import Document
+from selectolax.parser import HTMLParser as SelectolaxParser
+
+from utils.html_extract import extract_main_text
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, 'fixtures')
+RECORDED_CORPUS = os.path.join(BENCHMARK_DIR, 'corpus')
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def legacy_extract(html_content: bytes) -> str:
+    """重构前 Crawl._parse_html_with_selectolax 的抽取流程（不含文本清洗）"""
+    detected_encoding = None
+    detection_result = chardet.detect(html_content[:10000])
+    if detection_result and detection_result['confidence'] > 0.7:
+        detected_encoding = detection_result['encoding']
+    decoded_html = BeautifulSoup(html_content, 'lxml')
+    soup_str = str(decoded_html)
+    if soup_str.count('�') > len(soup_str) * 0.01 and detected_encoding:
+        decoded_html = BeautifulSoup(html_content.decode(detected_encoding, errors='replace'), 'lxml')
+    summary_html = Document(str(decoded_html)).summary(html_partial=True)
+    if not summary_html or len(summary_html) < 100:
+        body = decoded_html.find('body')
+        if body:
+            summary_html = str(body)
+    tree = SelectolaxParser(summary_html)
+    for node in tree.css('script, style, nav, footer, header, aside, form, a, img, figure, iframe, noscript'):
+        node.decompose()
+    return tree.body.text(separator='\n') if tree.body else ''
+
+
+def record(url_file: str, corpus: str):
+    os.makedirs(corpus, exist_ok=True)
+    index_path = os.path.join(corpus, 'index.json')
+    index: Dict[str, str] = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    with open(url_file, 'r', encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    with httpx.Client(http2=True, follow_redirects=True, timeout=15.0, headers={'User-Agent': USER_AGENT}) as client:
+        for url in urls:
+            try:
+                response = client.get(url)
+                response.raise_for_status()
+            except Exception as e:
+                print(f"跳过 {url}: {e}")
+                continue
+            name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16] + '.html'
+            with open(os.path.join(corpus, name), 'wb') as f:
+                f.write(response.content)
+            index[name] = url
+            print(f"已录制 {url} ({len(response.content)} bytes)")
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def _bigram_overlap(a: str, b: str) -> float:
+    a, b = ''.join(a.split()), ''.join(b.split())
+    grams_a = {a[i:i + 2] for i in range(len(a) - 1)}
+    grams_b = {b[i:i + 2] for i in range(len(b) - 1)}
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def _time(extract: Callable[[bytes], str], html: bytes, repeat: int) -> Tuple[float, str]:
+    best, text = float('inf'), ''
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        text = extract(html)
+        best = min(best, time.perf_counter() - started_at)
+    return best, text
+
+
+def run(corpus: str, repeat: int):
+    pages = sorted(name for name in os.listdir(corpus) if name.endswith('.html')) if os.path.isdir(corpus) else []
+    if not pages:
+        sys.exit(f"语料目录 {corpus} 中没有 .html 文件：使用默认的 {DEFAULT_CORPUS}，或先运行 record 录制")
+    legacy_times: List[float] = []
+    engine_times: List[float] = []
+    overlaps: List[float] = []
+    methods: Dict[str, int] = {}
+    for name in pages:
+        with open(os.path.join(corpus, name), 'rb') as f:
+            html = f.read()
+        try:
+            legacy_time, legacy_text = _time(legacy_extract, html, repeat)
+        except Exception as e:
+            print(f"{name}: 旧流程出错 {e}")
+            continue
+        engine_time, engine_text = _time(lambda content: extract_main_text(content)[0], html, repeat)
+        method = extract_main_text(html)[1]
+        methods[method] = methods.get(method, 0) + 1
+        legacy_times.append(legacy_time)
+        engine_times.append(engine_time)
+        overlaps.append(_bigram_overlap(legacy_text, engine_text))
+        print(f"{name}: 旧 {legacy_time * 1000:7.1f}ms  新 {engine_time * 1000:7.1f}ms  "
+              f"长度 {len(legacy_text):6d}/{len(engine_text):6d}  重合度 {overlaps[-1]:.2f}  {method}")
+
+    def summary(times: List[float]) -> str:
+        ordered = sorted(times)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"均值 {statistics.mean(times) * 1000:.1f}ms  中位数 {statistics.median(times) * 1000:.1f}ms  p95 {p95 * 1000:.1f}ms  合计 {sum(times):.2f}s"
+
+    print(f"\n页面数: {len(legacy_times)}")
+    print(f"旧流程: {summary(legacy_times)}")
+    print(f"新引擎: {summary(engine_times)}")
+    print(f"加速比: {sum(legacy_times) / max(sum(engine_times), 1e-9):.2f}x")
+    print(f"与旧流程正文的平均重合度: {statistics.mean(overlaps):.2f}")
+    print(f"抽取方法分布: {methods}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='网页正文抽取基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help='抓取URL列表录制语料')
+    record_parser.add_argument('url_file')
+    record_parser.add_argument('--corpus', default=RECORDED_CORPUS)
+    run_parser = subparsers.add_parser('run', help='在语料上运行基准')
+    run_parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.url_file, args.corpus)
+    else:
+        run(args.corpus, args.repeat)
@@ -0,0 +1,123 @@
+"""
+正文清洗基准测试：对比 Crawl 中旧的 _clean_text / _is_text_valid / _fix_encoding_issues
+与 utils/text_normalize 的实现，逐条校验输出一致并比较耗时。
+
+语料默认为 benchmarks/fixtures 中固定的网页（抽取正文后作为输入），也可指定 html_extraction_benchmark
+录制的目录；另附一组内置的边界用例:
+    python benchmarks/text_normalize_benchmark.py --repeat 5
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.html_extract import extract_main_text
+from utils.text_normalize import clean_text, fix_encoding_issues, is_text_valid
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+FIXTURES = [
+    '', '   ', 'short', '  前后空白\t\r\n 与制表符  ', 'a @ b # c', '重复标点！！！？？。。。,,,..', '.@.@.', '。#。', '..@,,x',
+    'emoji 😀😀😀 与 □■ 方块', 'aaaaaa 连续字符', '------ 与 ______ 不算重复', '哈哈哈哈哈哈哈', 'x' * 5 + 'y',
+    '&nbsp;&amp;&lt;tag&gt; &quot;q&quot; &#39;s&#39;', 'Itâ€™s a â€˜testâ€™ â€" done Â', 'trailing â€ and â alone',
+    'â€œquotedâ€\x9d text', '&amp;lt;b&amp;gt; escaped twice',
+    '%E4%B8%AD%E6%96%87%20%E6%B5%8B%E8%AF%95', 'mixed　全角！标点…与 不换行空格',
+    '正常的中文段落，包含逗号、句号。还有英文 words and numbers 12345.' * 20,
+]
+
+
+def legacy_clean_text(text: str) -> str:
+    text = re.sub(r'[\r\t\s]+', ' ', text)
+    text = re.sub(r'[^\w\s\u4e00-\u9fff\u3000-\u303f\uff00-\uff60\u2000-\u206f.,!?;:，。！？；：、]+', '', text)
+    text = re.sub(r'([.,!?;:，。！？；：、])\1+', r'\1', text)
+    return text.strip()
+
+
+def legacy_is_text_valid(text: str) -> bool:
+    if not text or len(text) < 20:
+        return False
+    questionable_chars = sum(1 for c in text if ord(c) > 0xFFFF or c == '□' or c == '■')
+    if len(text) > 0 and questionable_chars / len(text) > 0.15:
+        return False
+    for i in range(len(text) - 5):
+        if len(set(text[i:i+6])) == 1 and text[i] not in ('.', '-', '_', ' ', '*'):
+            return False
+    return True
+
+
+def legacy_fix_encoding_issues(text: str) -> str:
+    """
+    旧实现的真实行为，替换表按 Python 对旧源码的实际解析结果列出：旧源码中 'â€œ' 与 'â€' 的值各写成三个双引号，
+    两处连起来被解析成一个三引号字符串，于是 'â€œ' 被替换为 , 'â€': 这段文字，'â€' 本身不在表中；
+    'â€"' 重复出现，后一个 '—' 生效；末尾的空字符串键不起作用。替换逐条依次执行，前面的替换结果会被后面的再次替换。
+    新实现有意修正了这些问题，因此该函数的不一致条数反映的是预期的输出变化。
+    """
+    if '%' in text and text.count('%') > len(text) * 0.05:
+        from urllib.parse import unquote
+        try:
+            return unquote(text)
+        except Exception:
+            pass
+    replacements = {
+        '&nbsp;': ' ', '&amp;': '&', '&lt;': '<', '&gt;': '>', '&quot;': '"',
+        '&apos;': "'", '&#39;': "'", '&#160;': ' ', '&#xa0;': ' ',
+        'â€™': "'", 'â€"': "—", 'â€˜': "'",
+        'â€œ': ", 'â€': ", 'Â': '', 'â': '', '': '',
+    }
+    for wrong, correct in replacements.items():
+        text = text.replace(wrong, correct)
+    return text
+
+
+def load_corpus(corpus: str) -> List[str]:
+    texts = []
+    if os.path.isdir(corpus):
+        for name in sorted(os.listdir(corpus)):
+            if name.endswith('.html'):
+                with open(os.path.join(corpus, name), 'rb') as f:
+                    texts.append(extract_main_text(f.read(), name)[0])
+    return texts
+
+
+def _time(function: Callable[[str], object], texts: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def run(corpus: str, repeat: int):
+    texts = FIXTURES + load_corpus(corpus)
+    # 构造 100KB 以上的长文本，覆盖大页面
+    long_texts = [text * (100_000 // len(text) + 1) for text in texts if len(text) > 500]
+    inputs = texts + long_texts
+    print(f"输入: {len(texts)} 条（语料 {len(texts) - len(FIXTURES)} 页），另有 {len(long_texts)} 条 100KB+ 长文本")
+
+    pairs: List[Tuple[str, Callable, Callable]] = [
+        ('clean_text', legacy_clean_text, clean_text),
+        ('is_text_valid', legacy_is_text_valid, is_text_valid),
+        ('fix_encoding_issues', legacy_fix_encoding_issues, fix_encoding_issues),
+    ]
+    for name, legacy, engine in pairs:
+        mismatches = [text for text in inputs if legacy(text) != engine(text)]
+        for text in mismatches[:3]:
+            print(f"  {name} 不一致: {text[:80]!r}  旧 {legacy(text)[:80]!r}  新 {engine(text)[:80]!r}")
+        legacy_time = _time(legacy, inputs, repeat)
+        engine_time = _time(engine, inputs, repeat)
+        print(f"{name}: 不一致 {len(mismatches)} 条  旧 {legacy_time * 1000:8.1f}ms  新 {engine_time * 1000:8.1f}ms  "
+              f"加速比 {legacy_time / max(engine_time, 1e-9):.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='正文清洗基准测试')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.corpus, args.repeat)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from utils.answer_cache import SemanticAnswerCache
+
+
+def test_lookup_with_entries_from_two_embedding_models():
+    cache = SemanticAnswerCache()
+    cache.store('什么是量子纠缠', np.ones(4), 'model-a', 'answer a', [], '[Concept_Explanation]')
+    # 切换嵌入模型后写入的条目维度不同
+    cache.store('什么是量子纠缠', np.ones(8), 'model-b', 'answer b', [], '[Concept_Explanation]')
+
+    hit_a = cache.lookup('什么是量子纠缠', np.ones(4), 'model-a')
+    hit_b = cache.lookup('什么是量子纠缠', np.ones(8), 'model-b')
+
+    assert hit_a is not None and hit_a['answer'] == 'answer a'
+    assert hit_b is not None and hit_b['answer'] == 'answer b'
+    assert cache.lookup('什么是量子纠缠', np.ones(8), 'model-a') is None
+
+
+def test_lookup_after_store_sees_new_entry():
+    cache = SemanticAnswerCache()
+    cache.store('q1', np.array([1.0, 0.0]), 'model-a', 'first', [], None)
+    assert cache.lookup('q2', np.array([0.0, 1.0]), 'model-a') is None
+    cache.store('q2', np.array([0.0, 1.0]), 'model-a', 'second', [], None)
+    hit = cache.lookup('q2', np.array([0.0, 1.0]), 'model-a')
+    assert hit is not None and hit['answer'] == 'second'
+
+
+def test_entity_swapped_query_does_not_hit():
+    cache = SemanticAnswerCache()
+    vector = np.array([1.0, 0.2, 0.1])
+    cache.store('苹果公司2024年营收', vector, 'model-a', '苹果的营收', [], '[Specific_Fact_Lookup]')
+    cache.store('Google 2024 revenue', vector, 'model-a', 'Google revenue', [], '[Specific_Fact_Lookup]')
+
+    # 向量几乎相同，但实体或年份不同
+    assert cache.lookup('微软2024年营收', vector * 1.01, 'model-a') is None
+    assert cache.lookup('苹果公司2023年营收', vector, 'model-a') is None
+    assert cache.lookup('Microsoft 2024 revenue', vector, 'model-a') is None
+
+    hit = cache.lookup('苹果公司2024年营收是多少', vector, 'model-a')
+    assert hit is not None and hit['answer'] == '苹果的营收'
+    hit = cache.lookup('google revenue 2024', vector, 'model-a')
+    assert hit is not None and hit['answer'] == 'Google revenue'
+
+
+def test_disabled_by_default(monkeypatch):
+    from utils import answer_cache
+    monkeypatch.setattr(answer_cache.config, 'get', lambda key, default=None: default)
+    assert not SemanticAnswerCache.is_enabled()
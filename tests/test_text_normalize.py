@@ -0,0 +1,28 @@
+from utils.text_normalize import clean_text, fix_encoding_issues
+
+
+def test_curly_quote_mojibake_becomes_straight_quotes():
+    # 旧实现的替换表把 'â€œ' 映射成了 ", 'â€': "，右引号的乱码 'â€\x9d' 则只去掉了 'â'
+    assert fix_encoding_issues('â€œquotedâ€\x9d text') == '"quoted" text'
+    assert fix_encoding_issues('Itâ€™s a â€˜testâ€™') == "It's a 'test'"
+    assert fix_encoding_issues('a â€" b') == 'a — b'
+
+
+def test_stray_mojibake_bytes_are_removed():
+    assert fix_encoding_issues('Â price') == ' price'
+    assert fix_encoding_issues('trailing â alone') == 'trailing  alone'
+
+
+def test_entities_are_unescaped_once():
+    # 单次扫描替换，不再把替换结果当作新的实体再次替换
+    assert fix_encoding_issues('&amp;lt;b&amp;gt;') == '&lt;b&gt;'
+    assert fix_encoding_issues('&nbsp;&lt;tag&gt; &quot;q&quot; &#39;s&#39;') == ' <tag> "q" \'s\''
+
+
+def test_url_encoded_text_is_decoded():
+    assert fix_encoding_issues('%E4%B8%AD%E6%96%87%20%E6%B5%8B%E8%AF%95') == '中文 测试'
+
+
+def test_clean_text_collapses_whitespace_and_punctuation():
+    assert clean_text('  前后空白\t\r\n 与制表符  ') == '前后空白 与制表符'
+    assert clean_text('重复标点！！！？？。。。') == '重复标点！？。'
@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import jieba
+import numpy as np
+from .config_manager import config
+
+logger = logging.getLogger(__name__)
+
+# 不影响答案的疑问词与语气词，比较查询关键词时忽略
+QUERY_STOP_WORDS = frozenset([
+    '什么', '是', '的', '了', '吗', '呢', '啊', '吧', '请问', '一下', '怎么', '怎么样', '如何', '为什么', '哪些', '哪个',
+    '多少', '意思', '有', '关于', '介绍',
+    'what', 'is', 'are', 'the', 'a', 'an', 'of', 'how', 'to', 'why', 'which', 'about', 'does', 'do',
+])
+
+
+class SemanticAnswerCache:
+    """
+    以查询向量为键的最终答案缓存。
+
+    新查询与某个缓存查询的余弦相似度不低于 answer_cache_threshold，且两者的关键词集合相同时
+    直接复用其答案与参考来源。只换了实体、数字或日期的查询（如“苹果2024年营收”与“微软2024年营收”）
+    向量相似度往往也在阈值以上，关键词比较保证这类查询不会拿到错误的答案。默认关闭（answer_cache_enabled）。
+    有效期按 keywords_extract 给出的 identified_intent 决定：时效性强的意图（新闻、事实查询）
+    很快过期，概念解释等稳定内容保留更久。
+    """
+
+    MAX_ENTRIES = 2000
+    DEFAULT_THRESHOLD = 0.95
+    DEFAULT_TTL = 60 * 60  # seconds
+    INTENT_TTLS = {
+        '[Specific_Fact_Lookup]': 10 * 60,
+        '[Current_Event_Reporting]': 10 * 60,
+        '[Opinion_Review_Gathering]': 24 * 60 * 60,
+        '[Troubleshooting_Solution]': 3 * 24 * 60 * 60,
+        '[How-To_Instruction]': 7 * 24 * 60 * 60,
+        '[Comparative_Analysis]': 7 * 24 * 60 * 60,
+        '[Concept_Explanation]': 30 * 24 * 60 * 60,
+    }
+
+    def __init__(self):
+        self._entries: List[Dict[str, Any]] = []
+        # (嵌入模型, 维度) -> (条目下标, 归一化向量矩阵)；切换嵌入模型后缓存中会同时存在不同维度的向量
+        self._matrices: Dict[Tuple[str, int], Tuple[List[int], np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return str(config.get('answer_cache_enabled', 'false')).lower() == 'true'
+
+    @classmethod
+    def _threshold(cls) -> float:
+        try:
+            return float(config.get('answer_cache_threshold', cls.DEFAULT_THRESHOLD))
+        except (TypeError, ValueError):
+            return cls.DEFAULT_THRESHOLD
+
+    @classmethod
+    def ttl_for_intent(cls, intent: Optional[str]) -> float:
+        return cls.INTENT_TTLS.get(intent or '', cls.DEFAULT_TTL)
+
+    @staticmethod
+    def key_terms(query: str) -> frozenset:
+        """分词后去掉疑问词、语气词和标点，剩下的词（实体、数字、日期等）决定答案。"""
+        terms = (word.strip().lower() for word in jieba.cut(query))
+        return frozenset(term for term in terms if term and term not in QUERY_STOP_WORDS and any(c.isalnum() for c in term))
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _evict_expired(self, now: float):
+        alive = [entry for entry in self._entries if entry['expires_at'] > now]
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._matrices.clear()
+
+    def lookup(self, query: str, query_vector: np.ndarray, embedding_model: str) -> Optional[Dict[str, Any]]:
+        vector = self._normalize(query_vector)
+        if vector is None:
+            return None
+        key_terms = self.key_terms(query)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            key = (embedding_model, len(vector))
+            if key not in self._matrices:
+                candidates = [i for i, entry in enumerate(self._entries) if entry['embedding_model'] == embedding_model and len(entry['vector']) == len(vector)]
+                self._matrices[key] = (candidates, np.stack([self._entries[i]['vector'] for i in candidates]) if candidates else np.empty((0, len(vector)), dtype=np.float32))
+            candidates, matrix = self._matrices[key]
+            if not candidates:
+                self.stats['misses'] += 1
+                return None
+            similarities = matrix @ vector
+            # 阈值以上按相似度从高到低取第一个关键词相同的条目
+            threshold = self._threshold()
+            best = None
+            for i in np.argsort(-similarities):
+                if similarities[i] < threshold:
+                    break
+                if self._entries[candidates[i]]['key_terms'] == key_terms:
+                    best = int(i)
+                    break
+            if best is None:
+                self.stats['misses'] += 1
+                return None
+            entry = self._entries[candidates[best]]
+            self.stats['hits'] += 1
+            logger.info(f"Answer cache hit: '{entry['query']}' (similarity {similarities[best]:.3f})")
+            return {'query': entry['query'], 'answer': entry['answer'], 'references': entry['references'], 'similarity': float(similarities[best])}
+
+    def store(self, query: str, query_vector: np.ndarray, embedding_model: str, answer: str, references: List[Dict], intent: Optional[str]):
+        vector = self._normalize(query_vector)
+        if vector is None or not answer:
+            return
+        now = time.time()
+        entry = {
+            'query': query,
+            'key_terms': self.key_terms(query),
+            'vector': vector,
+            'embedding_model': embedding_model,
+            'answer': answer,
+            'references': references,
+            'intent': intent,
+            'expires_at': now + self.ttl_for_intent(intent),
+        }
+        with self._lock:
+            self._evict_expired(now)
+            self._entries.append(entry)
+            if len(self._entries) > self.MAX_ENTRIES:
+                # 淘汰最早过期的条目
+                self._entries.sort(key=lambda e: e['expires_at'])
+                self._entries = self._entries[len(self._entries) - self.MAX_ENTRIES:]
+            self._matrices.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {**self.stats, 'size': size, 'threshold': self._threshold()}
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,122 @@
+import re
+import codecs
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+try:
+    from charset_normalizer import from_bytes as _detect_with_normalizer
+except ImportError:  # 未安装 charset-normalizer 时退回纯 Python 的 chardet
+    _detect_with_normalizer = None
+    import chardet
+
+logger = logging.getLogger(__name__)
+
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9_\-]+)', re.I)
+XML_ENCODING = re.compile(rb'<\?xml[^>]+encoding=["\']([A-Za-z0-9_\-]+)', re.I)
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# 与浏览器一致：GB2312/GBK 按其超集 GB18030 解码，避免生僻字让严格解码失败
+ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030', 'big5': 'big5hkscs'}
+# 服务器常把单字节编码作为默认值下发，正文实际是合法 UTF-8 时以 UTF-8 为准
+WEAK_ENCODINGS = ('iso8859-1', 'ascii', 'cp1252')
+SNIFF_BYTES = 4096
+DETECT_BYTES = 10000
+
+
+def _normalize(label: Optional[str]) -> Optional[str]:
+    if not label:
+        return None
+    label = label.strip().strip('"\'').lower()
+    try:
+        name = codecs.lookup(ALIASES.get(label, label)).name
+    except LookupError:
+        return None
+    return ALIASES.get(name, name)
+
+
+def _decodes(body: bytes, encoding: str) -> bool:
+    try:
+        body.decode(encoding)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def _is_utf8(body: bytes) -> bool:
+    return _decodes(body, 'utf-8')
+
+
+def _sniff_meta(body: bytes) -> Optional[str]:
+    head = body[:SNIFF_BYTES]
+    match = META_CHARSET.search(head) or XML_ENCODING.search(head)
+    return match.group(1).decode('ascii') if match else None
+
+
+def detect_encoding(body: bytes) -> str:
+    """统计检测编码，只在声明的编码都不可用时使用。"""
+    sample = body[:DETECT_BYTES]
+    if _detect_with_normalizer is not None:
+        best = _detect_with_normalizer(sample).best()
+        encoding = best.encoding if best else None
+    else:
+        encoding = chardet.detect(sample).get('encoding')
+    return _normalize(encoding) or 'utf-8'
+
+
+class CharsetResolver:
+    """
+    按 BOM → HTTP Content-Type → <meta charset>/XML 声明 → UTF-8 的顺序确定网页编码，
+    都不可用时才调用统计检测（'detector'）。声明的编码需能严格解码正文才采用，否则继续下一层。
+    按层计数，便于观察有多少页面落到了代价最高的统计检测。
+    """
+
+    TIERS = ('bom', 'header', 'meta', 'utf-8', 'detector')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {tier: 0 for tier in self.TIERS}
+
+    @staticmethod
+    def _declared(body: bytes, header_charset: Optional[str]) -> Tuple[Optional[str], str]:
+        for bom, encoding in BOMS:
+            if body.startswith(bom):
+                return encoding, 'bom'
+        for tier, label in (('header', header_charset), ('meta', _sniff_meta(body))):
+            encoding = _normalize(label)
+            if encoding is None:
+                continue
+            if encoding in WEAK_ENCODINGS and not body.isascii() and _is_utf8(body):
+                return 'utf-8', 'utf-8'
+            if _decodes(body, encoding):
+                return encoding, tier
+            logger.debug(f"Declared {tier} charset {label} does not decode the body, trying next tier")
+        if _is_utf8(body):
+            return 'utf-8', 'utf-8'
+        return None, 'detector'
+
+    def resolve(self, body: bytes, header_charset: Optional[str] = None) -> Tuple[Optional[str], str]:
+        """
+        只执行廉价的几层，返回 (编码, 层)；编码为 None 表示需要统计检测，
+        调用方可把检测留到抽取进程中执行（见 decode）。
+        """
+        encoding, tier = self._declared(body, header_charset)
+        with self._lock:
+            self.stats[tier] += 1
+        return encoding, tier
+
+    @staticmethod
+    def decode(body: bytes, encoding: Optional[str] = None) -> str:
+        """按给定编码解码；未给出时依次尝试声明的编码并在最后统计检测（不计入统计）。"""
+        if encoding is None:
+            encoding, _ = CharsetResolver._declared(body, None)
+        return body.decode(encoding or detect_encoding(body), errors='replace')
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+charset_resolver = CharsetResolver()
@@ -0,0 +1,194 @@
+import logging
+import threading
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, List, Optional, TypeVar
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from openai import OpenAI, AsyncOpenAI
+from .config_manager import config
+from .dns_cache import CachedDNSTransport, dns_cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def _make_session(api_key: Optional[str], max_retries: int = 3) -> requests.Session:
+    session = requests.Session()
+    retries = Retry(
+        total=max_retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+    session.mount('https://', HTTPAdapter(max_retries=retries))
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    session.headers.update(headers)
+    return session
+
+
+class ClientSet:
+    """
+    一组按当前配置构建的长连接客户端，供所有请求共享。
+    LLM 客户端只有在配置完整时才会创建，否则为 None。
+    """
+
+    CRAWLER_TIMEOUT = httpx.Timeout(10.0, read=15.0, write=10.0, pool=10.0)
+    # 同一站点的请求在 HTTP/2 下复用一条连接多路复用，空闲连接保留一段时间供后续请求复用
+    CRAWLER_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0)
+
+    def __init__(self):
+        llm_api_key = config.get('llm_api_key')
+        llm_base_url = config.get('llm_base_url')
+        self.llm: Optional[AsyncOpenAI] = None
+        self.llm_sync: Optional[OpenAI] = None
+        if llm_api_key and llm_base_url:
+            self.llm = AsyncOpenAI(api_key=llm_api_key, base_url=llm_base_url)
+            self.llm_sync = OpenAI(api_key=llm_api_key, base_url=llm_base_url)
+        self.users = 0  # 持有该 ClientSet 的进行中请求数，由 ClientRegistry 在锁内维护
+
+        self.embedding_session = _make_session(config.get('embedding_api_key'))
+        self.rerank_session = _make_session(config.get('rerank_api_key'))
+        self.search_session = requests.Session()
+        try:
+            dns_ttl = float(config.get('dns_cache_ttl', dns_cache.DEFAULT_TTL))
+        except (TypeError, ValueError):
+            dns_ttl = dns_cache.DEFAULT_TTL
+        # DNS 缓存只挂在爬虫客户端的传输层上，不影响进程中的其他客户端
+        transport = None
+        if dns_ttl > 0:
+            dns_cache.set_ttl(dns_ttl)
+            transport = CachedDNSTransport(dns_cache, http2=True, limits=self.CRAWLER_LIMITS)
+        self.crawler = httpx.AsyncClient(http2=True, follow_redirects=True, timeout=self.CRAWLER_TIMEOUT, limits=self.CRAWLER_LIMITS, transport=transport)
+        self._closed = False
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        for close in (
+            self.llm.close if self.llm else None,
+            self.crawler.aclose,
+        ):
+            if close is None:
+                continue
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Error closing async client: {e}")
+        for close in (
+            self.llm_sync.close if self.llm_sync else None,
+            self.embedding_session.close,
+            self.rerank_session.close,
+            self.search_session.close,
+        ):
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Error closing client: {e}")
+
+
+class ClientRegistry:
+    """
+    进程级客户端注册表。
+
+    在 lifespan 中启动、关闭；POST /api/settings 重新加载配置后调用 rebuild()
+    原子地替换为新的 ClientSet。进行中的请求通过 lease() 持有请求开始时的 ClientSet，
+    期间 get() 始终返回它；被替换的 ClientSet 在最后一个持有它的请求结束后才关闭，
+    长时间的 LLM 流式输出或抓取不会中途失去客户端。
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+    _leased: ContextVar[Optional[ClientSet]] = ContextVar('leased_clients', default=None)
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(ClientRegistry, cls).__new__(cls)
+                    cls._instance._clients = None
+                    cls._instance._retired = []
+        return cls._instance
+
+    def get(self) -> ClientSet:
+        """返回 lease() 持有的 ClientSet，不在 lease() 内时返回当前的 ClientSet，未启动时（如脚本直接运行）按需构建。"""
+        leased = self._leased.get()
+        if leased is not None:
+            return leased
+        clients = self._clients
+        if clients is None:
+            with self._lock:
+                if self._clients is None:
+                    self._clients = ClientSet()
+                clients = self._clients
+        return clients
+
+    async def start(self):
+        self.get()
+        logger.info("Client registry started.")
+
+    async def rebuild(self):
+        new_clients = ClientSet()
+        with self._lock:
+            old_clients, self._clients = self._clients, new_clients
+            close_now = old_clients is not None and old_clients.users == 0
+            if old_clients is not None and not close_now:
+                self._retired.append(old_clients)
+        logger.info("Client registry rebuilt after settings change.")
+        if close_now:
+            await old_clients.aclose()
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[ClientSet]:
+        """
+        在上下文内固定使用同一个 ClientSet（嵌套时沿用外层的），退出时若它已被替换且没有其他持有者则关闭。
+        上下文变量会随 asyncio.create_task / asyncio.to_thread 传递给请求内派生的任务和线程。
+        """
+        clients = self.get()
+        with self._lock:
+            clients.users += 1
+        previous = self._leased.get()
+        self._leased.set(clients)
+        try:
+            yield clients
+        finally:
+            # 异步生成器可能在其他上下文中被关闭，不使用 reset(token)
+            self._leased.set(previous)
+            with self._lock:
+                clients.users -= 1
+                close_now = clients.users == 0 and clients in self._retired
+                if close_now:
+                    self._retired.remove(clients)
+            if close_now:
+                await clients.aclose()
+
+    async def leased(self, source: AsyncIterator[T]) -> AsyncIterator[T]:
+        """在 lease() 内逐项转发异步迭代器，流式响应在整个生成过程中持有同一个 ClientSet。"""
+        async with self.lease():
+            iterator = source.__aiter__()
+            try:
+                async for item in iterator:
+                    yield item
+            finally:
+                aclose = getattr(iterator, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+
+    async def close(self):
+        with self._lock:
+            to_close: List[ClientSet] = self._retired + ([self._clients] if self._clients else [])
+            self._clients = None
+            self._retired = []
+        for clients in to_close:
+            await clients.aclose()
+        logger.info("Client registry closed.")
+
+
+clients = ClientRegistry()
@@ -1,19 +1,54 @@
+import asyncio
 import httpx
 import fitz  # PyMuPDF
-from readability import Document
-from bs4 import BeautifulSoup
-import chardet  # 添加用于检测编码的库
-from selectolax.parser import HTMLParser as SelectolaxParser
 import re
 import json
 import time
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Optional, Tuple, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Any
 import logging
+from .config_manager import config
+from .latency_budget import LatencyBudget
+from .page_store import PageStore, canonicalize_url, page_identity, page_store
+from .domain_health import domain_health
+from .charset import charset_resolver
+from .html_extract import extract_main_text
+from .extract_pool import extraction_pool
+from .text_normalize import clean_text, fix_encoding_issues, is_text_valid
 
 logger = logging.getLogger(__name__)
 
+# 进程级的按站点并发上限，跨请求共享，避免对同一站点的突发请求触发限流
+class _HostLimiter:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0  # 正在请求及排队等待的请求数，为 0 时才可以淘汰或按新上限重建
+
+
+_host_limiters: Dict[str, _HostLimiter] = {}
+MAX_TRACKED_HOSTS = 4096
+
+
+@asynccontextmanager
+async def _host_slot(host: str, limit: int) -> AsyncIterator[None]:
+    limiter = _host_limiters.get(host)
+    # 上限变化（max_per_host 被修改）时，等该站点的请求全部结束后按新上限重建
+    if limiter is None or (limiter.limit != limit and limiter.active == 0):
+        if limiter is None and len(_host_limiters) >= MAX_TRACKED_HOSTS:
+            # 只清理当前没有请求占用或等待的站点
+            for idle_host in [h for h, l in _host_limiters.items() if l.active == 0]:
+                del _host_limiters[idle_host]
+        limiter = _host_limiters[host] = _HostLimiter(limit)
+    limiter.active += 1
+    try:
+        async with limiter.semaphore:
+            yield
+    finally:
+        limiter.active -= 1
+
 class Crawl:
 
     USER_AGENTS = [
@@ -22,125 +57,308 @@ class Crawl:
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0",
     ]
     MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB in bytes
+    DEFAULT_MAX_PER_HOST = 4
+    # 抓取结果只保留前 500 个字符，PDF 抽到该预算（含 _is_text_valid 与清洗的余量）即停止
+    PDF_CHAR_BUDGET = 2000
+    PDF_MAX_PAGES = 30
+    PDF_SCAN_PAGES = 8  # 按查询词选页时最多预读的页数
+    CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+    SNIFF_BYTES = 16  # 用于识别文件类型的响应体前缀长度
+    UNSUPPORTED_MEDIA_TYPES = ['image/', 'audio/', 'video/', 'application/zip', 'application/x-rar', 'application/x-tar']
+    # 常见二进制格式的文件头（magic number），响应头缺失或声明错误时据此提前中止下载
+    BINARY_SIGNATURES = [
+        b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'PK\x03\x04', b'Rar!', b'7z\xbc\xaf',
+        b'\x1f\x8b', b'BZh', b'\xfd7zXZ', b'ID3', b'OggS', b'fLaC', b'\x1aE\xdf\xa3', b'MZ',
+    ]
 
     def __init__(
             self,
             max_workers: int = 10,
             max_retries: int = 3,
             timeout_config: Tuple[float, float, float, float] = (10.0, 15.0, 10.0, 10.0),
+            async_client: Optional[httpx.AsyncClient] = None,
+            use_page_store: bool = True,
+            max_per_host: Optional[int] = None,
+            pdf_query_pages: bool = False,
     ):
+        """
+        max_per_host: 异步抓取时同一站点的最大并发请求数（进程内所有抓取共享），未给出时读取设置项 max_per_host
+        async_client: 可选的共享异步客户端（如 ClientRegistry 提供的连接池），
+                      传入时由调用方负责其生命周期，aclose() 不会关闭它
+        use_page_store: 是否使用按URL存储的已抓取网页（条件GET重新验证）
+        pdf_query_pages: PDF 是否按搜索词密度选页，而不是总从第一页开始
+        """
         self.MAX_WORKERS = max_workers
         self.MAX_RETRIES = max_retries
         self.TIMEOUT = httpx.Timeout(
             timeout_config[0], read=timeout_config[1], write=timeout_config[2], pool=timeout_config[3]
         )
-        self.client = httpx.Client(http2=True, follow_redirects=True, timeout=self.TIMEOUT)
+        self.page_store: Optional[PageStore] = page_store if use_page_store else None
+        self.MAX_PER_HOST = max(1, max_per_host if max_per_host is not None else self._configured_max_per_host())
+        self.pdf_query_pages = pdf_query_pages
+        self._host_ready: Dict[str, asyncio.Event] = {}
+        self._client: Optional[httpx.Client] = None
+        self._owns_async_client = async_client is None
+        self.async_client = async_client or httpx.AsyncClient(http2=True, follow_redirects=True, timeout=self.TIMEOUT)
+
+    @classmethod
+    def _configured_max_per_host(cls) -> int:
+        try:
+            return int(config.get('max_per_host', cls.DEFAULT_MAX_PER_HOST))
+        except (TypeError, ValueError):
+            return cls.DEFAULT_MAX_PER_HOST
+
+    @property
+    def client(self) -> httpx.Client:
+        # 同步客户端仅供线程池版 crawl 使用，按需创建
+        if self._client is None:
+            self._client = httpx.Client(http2=True, follow_redirects=True, timeout=self.TIMEOUT)
+        return self._client
 
     def _get_random_user_agent(self) -> str:
         return random.choice(self.USER_AGENTS)
 
-    def _clean_text(self, text: str) -> str:
-        text = re.sub(r'[\r\t\s]+', ' ', text)
-        text = re.sub(r'[^\w\s\u4e00-\u9fff\u3000-\u303f\uff00-\uff60\u2000-\u206f.,!?;:，。！？；：、]+', '', text)
-        text = re.sub(r'([.,!?;:，。！？；：、])\1+', r'\1', text)
-        return text.strip()
+    @staticmethod
+    def _clean_text(text: str) -> str:
+        return clean_text(text)
     
-    def _is_text_valid(self, text: str) -> bool:
+    @staticmethod
+    def _is_text_valid(text: str) -> bool:
         """
         检查文本是否有明显的乱码问题
         """
-        if not text or len(text) < 20:
-            return False
-        questionable_chars = sum(1 for c in text if ord(c) > 0xFFFF or c == '' or c == '□' or c == '■')
-        if len(text) > 0 and questionable_chars / len(text) > 0.15:  # 超过15%为乱码字符则认为无效
-            logger.warning(f"Text contains too many questionable characters: {questionable_chars}/{len(text)}")
-            return False
-        for i in range(len(text) - 5):
-            if len(set(text[i:i+6])) == 1 and text[i] not in ('.', '-', '_', ' ', '*'):
-                logger.warning(f"Text contains suspicious repetitive characters: {text[i:i+6]}")
-                return False
-                
-        return True
+        return is_text_valid(text)
     
-    def _fix_encoding_issues(self, text: str) -> str:
+    @staticmethod
+    def _fix_encoding_issues(text: str) -> str:
         """
         尝试修复常见的编码问题
         """
-        if '%' in text and text.count('%') > len(text) * 0.05:
-            from urllib.parse import unquote
-            try:
-                return unquote(text)
-            except:
-                pass
-        replacements = {
-            '&nbsp;': ' ', '&amp;': '&', '&lt;': '<', '&gt;': '>', '&quot;': '"',
-            '&apos;': "'", '&#39;': "'", '&#160;': ' ', '&#xa0;': ' ', 
-            'â€™': "'", 'â€"': "–", 'â€"': "—", 'â€˜': "'", 'â€™': "'",
-            'â€œ': """, 'â€': """, 'Â': '', 'â': '', '': '',
-        }
-        
-        for wrong, correct in replacements.items():
-            text = text.replace(wrong, correct)
-        
-        return text
+        return fix_encoding_issues(text)
 
-    def _parse_html_with_selectolax(self, html_content: bytes, url: str) -> str:
+    @classmethod
+    def _parse_html_with_selectolax(cls, html_content: bytes, url: str, encoding: Optional[str] = None) -> str:
+        """
+        单次 selectolax 解析完成去模板与正文打分（见 html_extract），置信度低时才回退到 readability。
+        不依赖实例状态，可在抽取进程池的子进程中调用
+        """
         try:
-            detected_encoding = None
-            try:
-                detection_result = chardet.detect(html_content[:10000])
-                if detection_result and detection_result['confidence'] > 0.7:
-                    detected_encoding = detection_result['encoding']
-                    logger.info(f"Detected encoding for {url}: {detected_encoding} (confidence: {detection_result['confidence']})")
-            except Exception as e:
-                logger.warning(f"Encoding detection failed for {url}: {e}")
-            decoded_html = BeautifulSoup(html_content, 'lxml')
-            soup_str = str(decoded_html)
-            if soup_str.count('') > len(soup_str) * 0.01 and detected_encoding:
-                try:
-                    html_str = html_content.decode(detected_encoding, errors='replace')
-                    decoded_html = BeautifulSoup(html_str, 'lxml')
-                    logger.info(f"Re-decoded HTML with detected encoding: {detected_encoding}")
-                except Exception as e:
-                    logger.warning(f"Failed to re-decode with detected encoding: {e}")
-            doc = Document(str(decoded_html))
-            summary_html = doc.summary(html_partial=True)
-            
-            if not summary_html or len(summary_html) < 100:
-                body = decoded_html.find('body')
-                if body:
-                    summary_html = str(body)
-                    logger.info(f"Readability extraction failed, using body tag for {url}")
-            tree = SelectolaxParser(summary_html)
-            for node in tree.css('script, style, nav, footer, header, aside, form, a, img, figure, iframe, noscript'):
-                node.decompose()
-            
-            main_text = ""
-            if tree.body:
-                main_text = tree.body.text(separator='\n')
-            cleaned_text = self._clean_text(main_text)
-            if not self._is_text_valid(cleaned_text):
+            main_text, method = extract_main_text(html_content, url, encoding)
+            if method != 'selectolax':
+                logger.info(f"Extracted {url} with {method}")
+            cleaned_text = cls._clean_text(main_text)
+            if not cls._is_text_valid(cleaned_text):
                 logger.warning(f"Text validity check failed for {url}, attempting encoding fixes")
-                fixed_text = self._fix_encoding_issues(main_text)
-                cleaned_text = self._clean_text(fixed_text)
+                fixed_text = cls._fix_encoding_issues(main_text)
+                cleaned_text = cls._clean_text(fixed_text)
             
             return cleaned_text
         except Exception as e:
             logger.error(f"Error parsing HTML for {url}: {e}", exc_info=True)
             return ""
 
-    def _extract_pdf_content(self, pdf_bytes: bytes, url: str) -> str:
+    @staticmethod
+    def _pdf_page_has_text(page) -> bool:
+        # 没有字体资源的页面（扫描件、纯图片页）不可能抽出文字，跳过 get_text 的排版开销
+        return bool(page.get_fonts())
+
+    @classmethod
+    def _query_terms(cls, query: Optional[str]) -> List[str]:
+        """
+        英文等按词切分；中文没有空格，\W+ 切分后整句仍是一个词，无法在页面中命中，
+        因此连续的中文拆成相邻二字组（单字则保留单字），不必在抽取进程中加载分词词典
+        """
+        terms: List[str] = []
+        for token in re.split(r'\W+', (query or '').lower()):
+            terms.extend(part for part in cls.CJK_RUN.split(token) if len(part) > 1)
+            for run in cls.CJK_RUN.findall(token):
+                terms.extend([run[i:i + 2] for i in range(len(run) - 1)] if len(run) > 1 else [run])
+        return list(dict.fromkeys(terms))
+
+    @classmethod
+    def _extract_pdf_content(cls, pdf_bytes: bytes, url: str, query: Optional[str] = None) -> str:
+        """
+        按字符预算抽取 PDF：最多看 PDF_MAX_PAGES 页，累计 PDF_CHAR_BUDGET 个字符即停止。
+        传入 query 时先在前 PDF_SCAN_PAGES 页中按查询词密度排序，优先取命中最多的页面。
+        """
         try:
-            full_text = []
+            collected: List[str] = []
+            total = 0
             with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-                for page in doc:
-                    full_text.append(page.get_text()) # type: ignore
-            return self._clean_text(" ".join(full_text))
+                page_count = min(doc.page_count, cls.PDF_MAX_PAGES)
+                texts: Dict[int, str] = {}
+                order = list(range(page_count))
+                terms = cls._query_terms(query)
+                if terms:
+                    for number in range(min(page_count, cls.PDF_SCAN_PAGES)):
+                        page = doc.load_page(number)
+                        texts[number] = page.get_text() if cls._pdf_page_has_text(page) else ''  # type: ignore
+                    density = {
+                        number: sum(text.lower().count(term) for term in terms) / (len(text) + 1)
+                        for number, text in texts.items()
+                    }
+                    # 命中页按密度优先，其余页保持原顺序
+                    order = sorted(order, key=lambda number: -density.get(number, 0.0))
+                for number in order:
+                    text = texts.get(number)
+                    if text is None:
+                        page = doc.load_page(number)
+                        text = page.get_text() if cls._pdf_page_has_text(page) else ''  # type: ignore
+                    text = cls._clean_text(text)
+                    if not text:
+                        continue
+                    collected.append(text)
+                    total += len(text)
+                    if total >= cls.PDF_CHAR_BUDGET:
+                        break
+            return cls._clean_text(" ".join(collected))
         except Exception as e:
             print(f"Error extracting PDF content for {url}: {e}")
             logger.error(f"Error extracting PDF content for {url}: {e}")
             return ""
 
+    def _build_headers(self) -> Dict[str, str]:
+        return {
+            'User-Agent': self._get_random_user_agent(),
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'Cache-Control': 'max-age=0'
+        }
+
+    def _should_skip_by_headers(self, response: httpx.Response, link: str) -> bool:
+        try:
+            content_length = int(response.headers.get('Content-Length', '0'))
+        except ValueError:
+            content_length = 0
+        if content_length > self.MAX_FILE_SIZE:
+            logger.warning(f"Skipping large file ({content_length/1024/1024:.1f}MB > {self.MAX_FILE_SIZE/1024/1024}MB): {link}")
+            return True
+        content_type = response.headers.get('Content-Type', '').lower()
+        if any(media_type in content_type for media_type in self.UNSUPPORTED_MEDIA_TYPES):
+            logger.info(f"Skipping unsupported media type {content_type}: {link}")
+            return True
+        return False
+
+    @staticmethod
+    def _needs_sniff(response: httpx.Response) -> bool:
+        """只有 Content-Type 缺失或为通用的 application/octet-stream 时才按文件头识别类型"""
+        media_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        return media_type in ('', 'application/octet-stream')
+
+    def _should_skip_by_magic(self, prefix: bytes, response: httpx.Response, link: str) -> bool:
+        """根据响应体前几个字节判断是否为不支持的二进制文件；octet-stream 只接受 PDF"""
+        if prefix.lstrip().startswith(b'%PDF'):
+            return False
+        if any(prefix.startswith(signature) for signature in self.BINARY_SIGNATURES) or prefix[4:8] == b'ftyp':
+            logger.info(f"Skipping binary content by signature {prefix[:8]!r}: {link}")
+            return True
+        if 'application/octet-stream' in response.headers.get('Content-Type', '').lower():
+            logger.info(f"Skipping media content application/octet-stream: {link}")
+            return True
+        return False
+
+    def _read_limit_exceeded(self, body: bytearray, link: str) -> bool:
+        if len(body) > self.MAX_FILE_SIZE:
+            logger.warning(f"Skipping large response (> {self.MAX_FILE_SIZE/1024/1024}MB), download aborted: {link}")
+            return True
+        return False
+
+    def _read_body(self, response: httpx.Response, link: str) -> Optional[bytes]:
+        """
+        流式读取响应体：Content-Type 缺失或为 octet-stream 时读到文件头即做类型识别，超过 MAX_FILE_SIZE 立即中止，不再完整下载后丢弃
+        """
+        body = bytearray()
+        sniffed = not self._needs_sniff(response)
+        for chunk in response.iter_bytes():
+            body += chunk
+            if not sniffed and len(body) >= self.SNIFF_BYTES:
+                sniffed = True
+                if self._should_skip_by_magic(bytes(body[:self.SNIFF_BYTES]), response, link):
+                    return None
+            if self._read_limit_exceeded(body, link):
+                return None
+        if not sniffed and self._should_skip_by_magic(bytes(body), response, link):
+            return None
+        return bytes(body)
+
+    async def _read_body_async(self, response: httpx.Response, link: str) -> Optional[bytes]:
+        body = bytearray()
+        sniffed = not self._needs_sniff(response)
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if not sniffed and len(body) >= self.SNIFF_BYTES:
+                sniffed = True
+                if self._should_skip_by_magic(bytes(body[:self.SNIFF_BYTES]), response, link):
+                    return None
+            if self._read_limit_exceeded(body, link):
+                return None
+        if not sniffed and self._should_skip_by_magic(bytes(body), response, link):
+            return None
+        return bytes(body)
+
+    def _process_response(self, web_info: Dict[str, Any], response: httpx.Response, body: bytes) -> Optional[Dict[str, Any]]:
+        """
+        对已读取完的GET响应体抽取正文，同步与异步抓取共用；较大的 HTML/PDF 交给抽取进程池
+        """
+        link = web_info.get('link')
+        query_key = web_info.get('query_key')
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'pdf' in content_type or str(response.url).lower().endswith('.pdf') or body.lstrip().startswith(b'%PDF'):
+            options = {'query': query_key} if self.pdf_query_pages else {}
+            content = extraction_pool.extract('pdf', body, str(response.url), self._extract_pdf_content, **options)
+        else:
+            # 响应头、BOM、<meta charset> 能确定编码时不做统计检测；需要检测时留给抽取进程
+            encoding, tier = charset_resolver.resolve(body, response.charset_encoding)
+            logger.debug(f"Charset for {link}: {encoding or 'undetermined'} ({tier})")
+            if 'text/plain' in content_type:
+                content = self._clean_text(charset_resolver.decode(body, encoding))
+            else:
+                content = extraction_pool.extract(
+                    'html', body, str(response.url), self._parse_html_with_selectolax, encoding=encoding
+                )
+        if content and len(content) > 20:
+            if not self._is_text_valid(content):
+                logger.warning(f"Content quality check failed for {link}")
+                return None
+
+            canonical_url = self._canonical_url(link)
+            if self.page_store is not None and canonical_url:
+                self.page_store.put(
+                    canonical_url, content,
+                    response.headers.get('ETag'), response.headers.get('Last-Modified')
+                )
+            return {
+                'id': web_info['id'],
+                'title': web_info.get('title', ''),
+                'link': link,
+                'content': content,
+                'query_key': query_key
+            }
+        else:
+            logger.warning(f"Content for {link} is too short or empty after cleaning")
+            return None
+
+    @staticmethod
+    def _canonical_url(link: str) -> Optional[str]:
+        # 端口非数字、IPv6 括号不完整等畸形URL会让 urlsplit 抛出 ValueError
+        try:
+            return canonicalize_url(link)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _stored_result(web_info: Dict[str, Any], stored: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': web_info['id'],
+            'title': web_info.get('title', ''),
+            'link': web_info.get('link'),
+            'content': stored['content'],
+            'query_key': web_info.get('query_key')
+        }
+
     def _fetch_one(self, web_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         link = web_info.get('link')
         query_key = web_info.get('query_key')
@@ -149,127 +367,312 @@ class Crawl:
             logger.error(f"Skipping invalid link for query '{query_key}': {link}")
             return None
 
-        for attempt in range(self.MAX_RETRIES):
+        canonical_url = self._canonical_url(link)
+        if canonical_url is None:
+            logger.error(f"Skipping malformed link for query '{query_key}': {link}")
+            return None
+        stored = self.page_store.get(canonical_url) if self.page_store is not None else None
+        if stored and self.page_store.is_fresh(stored):
+            logger.info(f"Using stored page for {link}")
+            return self._stored_result(web_info, stored)
+
+        host = domain_health.domain_of(link)
+        if not domain_health.allow(host):
+            logger.info(f"Circuit open for {host}, skipping {link}")
+            return self._stored_result(web_info, stored) if stored else None
+        timeout = domain_health.timeout_for(host, self.TIMEOUT)
+        max_retries = domain_health.retries_for(host, self.MAX_RETRIES)
+
+        for attempt in range(max_retries):
             try:
-                headers = {
-                    'User-Agent': self._get_random_user_agent(),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'Cache-Control': 'max-age=0'
-                }
-                try:
-                    head_response = self.client.head(link, headers=headers, follow_redirects=True, timeout=5.0)
-                    content_length = int(head_response.headers.get('Content-Length', '0'))
-                    if content_length > self.MAX_FILE_SIZE:
-                        logger.warning(f"Skipping large file ({content_length/1024/1024:.1f}MB > {self.MAX_FILE_SIZE/1024/1024}MB): {link}")
+                started_at = time.monotonic()
+                headers = self._build_headers()
+                if stored:
+                    headers.update(self.page_store.conditional_headers(stored))
+                # 单次流式GET：先看响应头和文件头，不支持的类型或超大文件在读完前中止
+                with self.client.stream('GET', link, headers=headers, timeout=timeout) as response:
+                    if response.status_code == 304 and stored:
+                        logger.info(f"Page not modified, reusing stored content: {link}")
+                        domain_health.record(host, 'ok', time.monotonic() - started_at)
+                        self.page_store.touch(canonical_url)
+                        return self._stored_result(web_info, stored)
+
+                    if 400 <= response.status_code < 500:
+                        logger.error(f"Client error {response.status_code} for {link}. Won't retry.")
+                        domain_health.record(host, domain_health.outcome_for_status(response.status_code))
                         return None
-                    content_type = head_response.headers.get('Content-Type', '').lower()
-                    if any(media_type in content_type for media_type in ['image/', 'audio/', 'video/', 'application/zip', 'application/x-rar', 'application/x-tar']):
-                        logger.info(f"Skipping unsupported media type {content_type}: {link}")
+
+                    response.raise_for_status()
+                    if self._should_skip_by_headers(response, link):
                         return None
-                except Exception as e:
-                    logger.warning(f"HEAD request failed for {link}, will try direct GET: {e}")
-                response = self.client.get(link, headers=headers)
-                
-                if 400 <= response.status_code < 500:
-                    logger.error(f"Client error {response.status_code} for {link}. Won't retry.")
+                    body = self._read_body(response, link)
+                if body is None:
                     return None
+                latency = time.monotonic() - started_at
+                result = self._process_response(web_info, response, body)
+                domain_health.record(host, 'ok' if result else 'extraction_failed', latency)
+                return result
                     
-                response.raise_for_status()
-                if len(response.content) > self.MAX_FILE_SIZE:
-                    logger.warning(f"Skipping large response ({len(response.content)/1024/1024:.1f}MB > {self.MAX_FILE_SIZE/1024/1024}MB): {link}")
-                    return None
-                content_type = response.headers.get('Content-Type', '').lower()
-                if any(media_type in content_type for media_type in ['image/', 'audio/', 'video/', 'application/zip', 'application/x-rar', 'application/octet-stream']):
-                    logger.info(f"Skipping media content {content_type}: {link}")
+            except httpx.RequestError as e:
+                logger.error(f"Attempt {attempt + 1}/{max_retries}: Network error for {link}: {type(e).__name__}")
+                if attempt < max_retries - 1:
+                    sleep_time = (2 ** attempt) + random.uniform(0.5, 1.0)
+                    time.sleep(sleep_time)
+                else:
+                    # 一次抓取只记录一个结果，重试中的失败不单独计数
+                    domain_health.record(host, 'error')
+                    logger.error(f"FAIL: Max retries reached for {link}. Error: {e}")
                     return None
-                if 'pdf' in content_type or str(response.url).lower().endswith('.pdf'):
-                    content = self._extract_pdf_content(response.content, str(response.url))
-                elif 'text/plain' in content_type:
-                    try:
-                        text = response.text
-                        content = self._clean_text(text)
-                    except Exception as e:
-                        logger.error(f"Error decoding plain text: {e}")
-                        encoding = chardet.detect(response.content[:10000])['encoding']
-                        if encoding:
-                            text = response.content.decode(encoding, errors='replace')
-                            content = self._clean_text(text)
-                        else:
+            except Exception as e:
+                domain_health.record(host, 'error')
+                logger.error(f"An unexpected error occurred for {link}: {e}", exc_info=True)
+                return None
+                
+        return None
+
+    async def _wait_for_host_connection(self, host: str) -> Optional[asyncio.Event]:
+        """
+        同一次抓取中某站点的第一个请求先建立连接，其余请求等它收到响应头后再发出，
+        从而在 HTTP/2 下复用同一条多路复用连接，而不是并发握手出多条连接。
+        返回值非 None 表示当前请求是该站点的第一个请求，需要在建立连接后 set()。
+        """
+        ready = self._host_ready.get(host)
+        if ready is None:
+            ready = self._host_ready[host] = asyncio.Event()
+            return ready
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=self.TIMEOUT.connect)
+        except asyncio.TimeoutError:
+            pass
+        return None
+
+    async def _fetch_one_async(self, web_info: Dict[str, Any], semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        """
+        _fetch_one 的异步版本：网络IO在事件循环上完成，重试退避使用 asyncio.sleep，
+        正文解析等CPU密集工作放到线程中执行，避免阻塞事件循环。
+        同一站点的请求共用一条连接，并受 MAX_PER_HOST 并发上限约束
+        """
+        link = web_info.get('link')
+        query_key = web_info.get('query_key')
+
+        if not link or not isinstance(link, str) or not link.startswith('http'):
+            logger.error(f"Skipping invalid link for query '{query_key}': {link}")
+            return None
+
+        canonical_url = self._canonical_url(link)
+        if canonical_url is None:
+            logger.error(f"Skipping malformed link for query '{query_key}': {link}")
+            return None
+        stored = await asyncio.to_thread(self.page_store.get, canonical_url) if self.page_store is not None else None
+        if stored and self.page_store.is_fresh(stored):
+            logger.info(f"Using stored page for {link}")
+            return self._stored_result(web_info, stored)
+
+        host = domain_health.domain_of(link)
+        if not domain_health.allow(host):
+            logger.info(f"Circuit open for {host}, skipping {link}")
+            return self._stored_result(web_info, stored) if stored else None
+        host_ready = await self._wait_for_host_connection(host)
+        try:
+            return await self._fetch_with_retries(web_info, canonical_url, stored, host, host_ready, semaphore)
+        finally:
+            if host_ready is not None:
+                host_ready.set()
+
+    async def _fetch_with_retries(
+            self,
+            web_info: Dict[str, Any],
+            canonical_url: str,
+            stored: Optional[Dict[str, Any]],
+            host: str,
+            host_ready: Optional[asyncio.Event],
+            semaphore: asyncio.Semaphore,
+    ) -> Optional[Dict[str, Any]]:
+        link = web_info.get('link')
+        timeout = domain_health.timeout_for(host, self.TIMEOUT)
+        max_retries = domain_health.retries_for(host, self.MAX_RETRIES)
+        for attempt in range(max_retries):
+            try:
+                async with _host_slot(host, self.MAX_PER_HOST), semaphore:
+                    started_at = time.monotonic()
+                    headers = self._build_headers()
+                    if stored:
+                        headers.update(self.page_store.conditional_headers(stored))
+                    async with self.async_client.stream('GET', link, headers=headers, timeout=timeout) as response:
+                        if host_ready is not None:
+                            host_ready.set()
+                        if response.status_code == 304 and stored:
+                            logger.info(f"Page not modified, reusing stored content: {link}")
+                            domain_health.record(host, 'ok', time.monotonic() - started_at)
+                            await asyncio.to_thread(self.page_store.touch, canonical_url)
+                            return self._stored_result(web_info, stored)
+
+                        if 400 <= response.status_code < 500:
+                            logger.error(f"Client error {response.status_code} for {link}. Won't retry.")
+                            domain_health.record(host, domain_health.outcome_for_status(response.status_code))
                             return None
-                else:
-                    content = self._parse_html_with_selectolax(response.content, str(response.url))
-                if content and len(content) > 20:
-                    if not self._is_text_valid(content):
-                        logger.warning(f"Content quality check failed for {link}")
-                        return None
-                        
-                    return {
-                        'id': web_info['id'],
-                        'title': web_info.get('title', ''),
-                        'link': link,
-                        'content': content,
-                        'query_key': query_key
-                    }
-                else:
-                    logger.warning(f"Content for {link} is too short or empty after cleaning")
+
+                        response.raise_for_status()
+                        if self._should_skip_by_headers(response, link):
+                            return None
+                        body = await self._read_body_async(response, link)
+                    latency = time.monotonic() - started_at
+
+                if body is None:
                     return None
-                    
+                result = await asyncio.to_thread(self._process_response, web_info, response, body)
+                domain_health.record(host, 'ok' if result else 'extraction_failed', latency)
+                return result
+
             except httpx.RequestError as e:
-                logger.error(f"Attempt {attempt + 1}/{self.MAX_RETRIES}: Network error for {link}: {type(e).__name__}")
-                if attempt < self.MAX_RETRIES - 1:
+                logger.error(f"Attempt {attempt + 1}/{max_retries}: Network error for {link}: {type(e).__name__}")
+                if attempt < max_retries - 1:
                     sleep_time = (2 ** attempt) + random.uniform(0.5, 1.0)
-                    time.sleep(sleep_time)
+                    await asyncio.sleep(sleep_time)
                 else:
+                    # 一次抓取只记录一个结果，重试中的失败不单独计数
+                    domain_health.record(host, 'error')
                     logger.error(f"FAIL: Max retries reached for {link}. Error: {e}")
                     return None
             except Exception as e:
+                domain_health.record(host, 'error')
                 logger.error(f"An unexpected error occurred for {link}: {e}", exc_info=True)
                 return None
-                
+
         return None
 
+    @staticmethod
+    def _build_tasks(search_results: Dict[str, List[Dict]]) -> List[Dict[str, Any]]:
+        """
+        多个查询常返回同一网页（仅跟踪参数、http/https 或 www. 不同），按 page_identity 合并为一个抓取任务，
+        referrers 记录引用它的每个查询及其在该查询结果中的条目（取排名最靠前的一条）。
+        """
+        tasks: List[Dict[str, Any]] = []
+        by_identity: Dict[str, Dict[str, Any]] = {}
+        total = 0
+        for query_key, items in search_results.items():
+            for item in items:
+                total += 1
+                link = item.get('link')
+                identity = None
+                if isinstance(link, str) and link.startswith('http'):
+                    try:
+                        identity = page_identity(link)
+                    except ValueError:
+                        # 畸形URL不参与去重，抓取时会被跳过
+                        pass
+                task_item = by_identity.get(identity) if identity else None
+                if task_item is None:
+                    task_item = item.copy()
+                    task_item['query_key'] = query_key
+                    task_item['referrers'] = {}
+                    tasks.append(task_item)
+                    if identity:
+                        by_identity[identity] = task_item
+                task_item['referrers'].setdefault(query_key, item)
+        if len(tasks) < total:
+            logger.info(f"Crawling {len(tasks)} unique pages for {total} search results")
+        return tasks
+
+    @staticmethod
+    def _fan_out(result: Optional[Dict[str, Any]], task: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        把一次抓取的结果复制给引用它的每个查询：id 与标题取该查询自己的结果，
+        query_ranks 记录该网页在各查询结果中的排名，供融合排序参考
+        """
+        if not result:
+            return []
+        result.pop('query_key', None)
+        query_ranks = {query: item.get('id') for query, item in task['referrers'].items()}
+        pages = []
+        for query, item in task['referrers'].items():
+            page = dict(result, id=item.get('id'), title=item.get('title') or result.get('title', ''))
+            page['query_ranks'] = dict(query_ranks)
+            pages.append((query, page))
+        return pages
+
+    @staticmethod
+    def _truncate_content(result: Dict[str, Any]) -> Dict[str, Any]:
+        # Truncate content to first 500 characters for each crawled page
+        if 'content' in result and result['content']:
+            result['content'] = result['content'][:500]
+            # Add ellipsis to indicate truncation
+            if len(result['content']) >= 500:
+                result['content'] += '...'
+        return result
+
+    @staticmethod
+    def _finalize_results(crawled_results: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+        for query in crawled_results:
+            crawled_results[query] = sorted(crawled_results[query], key=lambda x: x['id'])
+        logger.info(f'crawled_results: {json.dumps(crawled_results,ensure_ascii=False,indent=2)}')
+        return crawled_results
+
     def crawl(self, search_results: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
         """
         search_results: {query: [{'id': 0, 'title': 'title', 'link': 'link'}, {'id': 1, 'title': 'title', 'link': 'link'}]}
         """
         crawled_results = {query: [] for query in search_results.keys()}
-        tasks = []
-
-        for query_key, items in search_results.items():
-            for item in items:
-                task_item = item.copy()
-                task_item['query_key'] = query_key
-                tasks.append(task_item)
+        tasks = self._build_tasks(search_results)
 
         with ThreadPoolExecutor(max_workers=max(1,min(self.MAX_WORKERS, len(tasks)))) as executor:
             future_to_task = {executor.submit(self._fetch_one, task): task for task in tasks}
 
             for future in as_completed(future_to_task):
-                result = future.result()
-                if result:
-                    original_query = result.pop('query_key')
-                    crawled_results[original_query].append(result)
-        
-        for query in crawled_results:
-            crawled_results[query] = sorted(crawled_results[query], key=lambda x: x['id'])
-        # Truncate content to first 500 characters for each crawled page
-        for query in crawled_results:
-            for result in crawled_results[query]:
-                if 'content' in result and result['content']:
-                    result['content'] = result['content'][:500]
-                    # Add ellipsis to indicate truncation
-                    if len(result['content']) >= 500:
-                        result['content'] += '...'
-        logger.info(f'crawled_results: {json.dumps(crawled_results,ensure_ascii=False,indent=2)}')
+                for original_query, page in self._fan_out(future.result(), future_to_task[future]):
+                    crawled_results[original_query].append(self._truncate_content(page))
             
-        return crawled_results
+        return self._finalize_results(crawled_results)
+
+    async def _fetch_task_async(self, task: Dict[str, Any], semaphore: asyncio.Semaphore) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        # as_completed 不保留任务与结果的对应关系，连同任务一起返回以便分发给各个查询
+        return task, await self._fetch_one_async(task, semaphore)
+
+    async def crawl_stream(self, search_results: Dict[str, List[Dict]], after: Optional[asyncio.Future] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        按完成顺序逐个产出 (query, page)，下游无需等待最慢的网页即可开始处理。
+        提前退出迭代时会取消尚未完成的抓取任务。
+        after: 可选的进行中的预抓取任务，等它把网页写入页面存储后再开始，相同网页直接命中而不重复下载
+        """
+        if after is not None:
+            await asyncio.wait([after])
+        tasks = self._build_tasks(search_results)
+        semaphore = asyncio.Semaphore(max(1, self.MAX_WORKERS))
+        fetch_tasks = [asyncio.create_task(self._fetch_task_async(task, semaphore)) for task in tasks]
+        try:
+            for coro in asyncio.as_completed(fetch_tasks):
+                task, result = await coro
+                for original_query, page in self._fan_out(result, task):
+                    yield original_query, self._truncate_content(page)
+        finally:
+            for task in fetch_tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def crawl_async(self, search_results: Dict[str, List[Dict]], budget: Optional[LatencyBudget] = None, after: Optional[asyncio.Future] = None) -> Dict[str, List[Dict]]:
+        """
+        crawl 的异步版本，并发数由信号量限制为 MAX_WORKERS，返回结构与 crawl 相同
+        search_results: {query: [{'id': 0, 'title': 'title', 'link': 'link'}, ...]}
+        budget: 可选的请求时延预算，crawl 阶段到期后只返回已抓取完成的网页
+        after: 见 crawl_stream
+        """
+        crawled_results = {query: [] for query in search_results.keys()}
+        page_stream = self.crawl_stream(search_results, after=after)
+        if budget is not None:
+            page_stream = budget.iterate('crawl', page_stream)
+        async for original_query, result in page_stream:
+            crawled_results[original_query].append(result)
+
+        return self._finalize_results(crawled_results)
 
     def close(self):
-        self.client.close()
+        if self._client is not None:
+            self._client.close()
+
+    async def aclose(self):
+        self.close()
+        if self._owns_async_client:
+            await self.async_client.aclose()
 
 if __name__ == '__main__':
     sample_search_data = {
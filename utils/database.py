@@ -1,10 +1,13 @@
 import sqlite3
+import json
+import time
 import uuid
 from datetime import datetime
 import logging
 
 DATABASE_NAME = 'chat_history_docker.db'
 CONFIG_DATABASE_NAME = 'config_docker.db'
+CACHE_DATABASE_NAME = 'cache_docker.db'
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,11 @@ def get_config_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_cache_db_connection():
+    conn = sqlite3.connect(CACHE_DATABASE_NAME)
+    conn.row_factory = sqlite3.Row
+    return conn
+
 def create_tables():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -63,6 +71,33 @@ def create_tables():
     ''')
     config_conn.commit()
     config_conn.close()
+    cache_conn = get_cache_db_connection()
+    cache_cursor = cache_conn.cursor()
+    cache_cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_cache (
+            engine TEXT NOT NULL,
+            query TEXT NOT NULL,
+            results TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (engine, query)
+        )
+    ''')
+    cache_cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_cache_last_access ON search_cache (last_access)')
+    cache_cursor.execute('''
+        CREATE TABLE IF NOT EXISTS page_store (
+            url TEXT PRIMARY KEY,
+            content BLOB NOT NULL, -- zlib 压缩后的正文
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            size INTEGER NOT NULL
+        )
+    ''')
+    cache_cursor.execute('CREATE INDEX IF NOT EXISTS idx_page_store_last_access ON page_store (last_access)')
+    cache_conn.commit()
+    cache_conn.close()
 
 # 用户注册
 def register_user(user_id, password):
@@ -257,6 +292,160 @@ def get_setting(key: str) -> str | None:
     finally:
         conn.close()
 
+# 搜索引擎结果缓存
+def get_search_cache(engine: str, query: str, ttl: float) -> list | None:
+    """Returns cached engine results if they are younger than ttl seconds, refreshing their LRU position."""
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute(
+            "SELECT results, created_at FROM search_cache WHERE engine = ? AND query = ?",
+            (engine, query)
+        )
+        row = cursor.fetchone()
+        if not row or now - row['created_at'] > ttl:
+            return None
+        cursor.execute(
+            "UPDATE search_cache SET last_access = ? WHERE engine = ? AND query = ?",
+            (now, engine, query)
+        )
+        conn.commit()
+        return json.loads(row['results'])
+    except (sqlite3.Error, json.JSONDecodeError) as e:
+        print(f"Database error while reading search cache: {e}")
+        return None
+    finally:
+        conn.close()
+
+def set_search_cache(engine: str, query: str, results: list, max_entries: int):
+    """Stores engine results and evicts the least recently used entries beyond max_entries."""
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute(
+            "INSERT OR REPLACE INTO search_cache (engine, query, results, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (engine, query, json.dumps(results, ensure_ascii=False), now, now)
+        )
+        cursor.execute(
+            "DELETE FROM search_cache WHERE rowid IN ("
+            "SELECT rowid FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error while writing search cache: {e}")
+    finally:
+        conn.close()
+
+def list_search_cache(limit: int = 100) -> list:
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT engine, query, results, created_at, last_access FROM search_cache ORDER BY last_access DESC LIMIT ?",
+            (limit,)
+        )
+        return [{
+            'engine': row['engine'],
+            'query': row['query'],
+            'result_count': len(json.loads(row['results'])),
+            'created_at': row['created_at'],
+            'last_access': row['last_access'],
+        } for row in cursor.fetchall()]
+    except (sqlite3.Error, json.JSONDecodeError) as e:
+        print(f"Database error while listing search cache: {e}")
+        return []
+    finally:
+        conn.close()
+
+def purge_search_cache(engine: str | None = None, query: str | None = None) -> int:
+    """Deletes cache entries matching engine and/or query (all entries if neither is given)."""
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    conditions, params = [], []
+    if engine:
+        conditions.append("engine = ?")
+        params.append(engine)
+    if query:
+        conditions.append("query = ?")
+        params.append(query)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        cursor.execute(f"DELETE FROM search_cache{where}", params)
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Database error while purging search cache: {e}")
+        return 0
+    finally:
+        conn.close()
+
+# 已抓取网页存储
+def get_page(url: str) -> dict | None:
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT content, etag, last_modified, fetched_at FROM page_store WHERE url = ?",
+            (url,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute("UPDATE page_store SET last_access = ? WHERE url = ?", (time.time(), url))
+        conn.commit()
+        return {
+            'content': row['content'],
+            'etag': row['etag'],
+            'last_modified': row['last_modified'],
+            'fetched_at': row['fetched_at'],
+        }
+    except sqlite3.Error as e:
+        print(f"Database error while reading page store: {e}")
+        return None
+    finally:
+        conn.close()
+
+def save_page(url: str, content: bytes, etag: str | None, last_modified: str | None, max_bytes: int):
+    """Stores a compressed page and evicts least recently used pages once the store exceeds max_bytes."""
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute(
+            "INSERT OR REPLACE INTO page_store (url, content, etag, last_modified, fetched_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, content, etag, last_modified, now, now, len(content))
+        )
+        cursor.execute(
+            "DELETE FROM page_store WHERE url IN ("
+            "SELECT url FROM (SELECT url, SUM(size) OVER (ORDER BY last_access DESC) AS total FROM page_store) "
+            "WHERE total > ?)",
+            (max_bytes,)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error while writing page store: {e}")
+    finally:
+        conn.close()
+
+def touch_page(url: str):
+    """Marks a stored page as revalidated now (e.g. after a 304 Not Modified)."""
+    conn = get_cache_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute(
+            "UPDATE page_store SET fetched_at = ?, last_access = ? WHERE url = ?",
+            (now, now, url)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error while touching page store: {e}")
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
     create_tables()
     print("Database tables created successfully.")
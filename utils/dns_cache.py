@@ -0,0 +1,113 @@
+import socket
+import asyncio
+import logging
+import ipaddress
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+import httpcore
+import httpx
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class DNSCache:
+    """
+    爬虫专用的 DNS 解析缓存：在 TTL 内复用同一主机的解析结果。
+
+    只作用于挂载了 CachedDNSTransport 的 httpx 客户端（ClientSet.crawler），不替换
+    socket.getaddrinfo，LLM/嵌入等其他客户端照常解析。同一站点的多个网页以及连续的请求
+    不必重复解析。解析失败不缓存；缓存的地址全部连接失败时删除该条目，下次重新解析。
+    """
+
+    DEFAULT_TTL = 5 * 60  # seconds
+    MAX_ENTRIES = 4096
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self._cache: TTLCache = TTLCache(maxsize=self.MAX_ENTRIES, ttl=ttl)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def set_ttl(self, ttl: float):
+        """配置变化时以新的 TTL 重建缓存，TTL 不变时保留已缓存的结果。"""
+        with self._lock:
+            if self._cache.ttl != ttl:
+                self._cache = TTLCache(maxsize=self.MAX_ENTRIES, ttl=ttl)
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        """返回主机的 IP 地址列表；host 本身是 IP 时原样返回。"""
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        with self._lock:
+            addresses = self._cache.get(key)
+            if addresses is not None:
+                self.stats['hits'] += 1
+                return list(addresses)
+            self.stats['misses'] += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._cache[key] = addresses
+        return addresses
+
+    def invalidate(self, host: str, port: int):
+        with self._lock:
+            self._cache.pop((host, port), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'size': len(self._cache), 'ttl': self._cache.ttl}
+
+
+class _CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """连接前用 DNSCache 解析主机名，按解析出的地址依次尝试；TLS 的 SNI 与证书校验仍使用原主机名。"""
+
+    def __init__(self, cache: DNSCache):
+        self._cache = cache
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None, local_address: Optional[str] = None,
+                          socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await self._cache.resolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        self._cache.invalidate(host, port)
+        raise error or httpcore.ConnectError(f"No address resolved for {host}")
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+class CachedDNSTransport(httpx.AsyncHTTPTransport):
+    """使用 DNSCache 解析主机名的 httpx 传输层，只用于爬虫客户端。"""
+
+    def __init__(self, cache: DNSCache, http2: bool = False, limits: httpx.Limits = httpx.Limits()):
+        super().__init__(http2=http2, limits=limits)
+        # httpx 的传输层不接受自定义 network_backend，按相同参数重建连接池
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=_CachedDNSBackend(cache),
+        )
+
+
+dns_cache = DNSCache()
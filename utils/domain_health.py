@@ -0,0 +1,161 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class _DomainStats:
+    def __init__(self, window: int):
+        self.outcomes: deque = deque(maxlen=window)  # (outcome, latency or None)
+        self.open_until = 0.0
+        self.trial_started = 0.0  # 半开状态下试探请求的开始时间，0 表示没有试探请求
+
+
+class DomainHealthTracker:
+    """
+    按域名统计最近的抓取结果，用于调整超时/重试并对持续失败的域名熔断。
+
+    每次抓取记录一个结果：
+      ok               成功抓取并抽取到有效正文
+      extraction_failed 请求成功但正文为空或未通过 _is_text_valid
+      paywall          401/402/403/451，多为付费墙或反爬
+      client_error     其他 4xx
+      error            网络错误、超时或 5xx
+    最近 CIRCUIT_MIN_SAMPLES 次以上且失败率达到 CIRCUIT_FAILURE_RATE 时熔断 CIRCUIT_COOLDOWN 秒，
+    冷却结束后放行一个试探请求，成功则恢复，失败则再次熔断。
+    """
+
+    WINDOW = 50
+    MIN_SAMPLES = 5  # 少于该样本数时使用默认超时与重试次数
+    CIRCUIT_MIN_SAMPLES = 10
+    CIRCUIT_FAILURE_RATE = 0.8
+    CIRCUIT_COOLDOWN = 10 * 60  # seconds
+    TRIAL_TIMEOUT = 60  # 试探请求未回报结果（如被取消）时，超过该时间允许新的试探
+    HIGH_ERROR_RATE = 0.5  # 超过该网络错误率时不再重试
+    MIN_CONNECT_TIMEOUT = 2.0
+    MIN_READ_TIMEOUT = 3.0
+    MAX_TRACKED_DOMAINS = 10000
+    FAILURES = ('extraction_failed', 'paywall', 'client_error', 'error')
+    PAYWALL_STATUS = (401, 402, 403, 451)
+
+    def __init__(self):
+        self._domains: Dict[str, _DomainStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def domain_of(url: str) -> str:
+        return (urlsplit(url).hostname or '').lower()
+
+    @classmethod
+    def outcome_for_status(cls, status_code: int) -> str:
+        return 'paywall' if status_code in cls.PAYWALL_STATUS else 'client_error'
+
+    def _stats(self, domain: str) -> _DomainStats:
+        stats = self._domains.get(domain)
+        if stats is None:
+            if len(self._domains) >= self.MAX_TRACKED_DOMAINS:
+                # 淘汰未熔断且样本最少的域名
+                victim = min(
+                    (d for d, s in self._domains.items() if s.open_until == 0.0),
+                    key=lambda d: len(self._domains[d].outcomes),
+                    default=None,
+                )
+                if victim is not None:
+                    del self._domains[victim]
+            stats = self._domains[domain] = _DomainStats(self.WINDOW)
+        return stats
+
+    def allow(self, domain: str) -> bool:
+        """熔断期间返回 False；冷却结束后只放行一个试探请求。"""
+        with self._lock:
+            stats = self._domains.get(domain)
+            if stats is None or stats.open_until == 0.0:
+                return True
+            now = time.time()
+            if now < stats.open_until or now - stats.trial_started < self.TRIAL_TIMEOUT:
+                return False
+            stats.trial_started = now
+            return True
+
+    def record(self, domain: str, outcome: str, latency: Optional[float] = None):
+        with self._lock:
+            stats = self._stats(domain)
+            stats.outcomes.append((outcome, latency))
+            if stats.trial_started:
+                stats.trial_started = 0.0
+                if outcome == 'ok':
+                    # 恢复后重新累计，避免窗口中旧的失败记录让一次偶发失败就再次熔断
+                    stats.open_until = 0.0
+                    stats.outcomes.clear()
+                    stats.outcomes.append((outcome, latency))
+                    logger.info(f"Circuit closed for {domain}")
+                else:
+                    stats.open_until = time.time() + self.CIRCUIT_COOLDOWN
+                return
+            if stats.open_until == 0.0 and len(stats.outcomes) >= self.CIRCUIT_MIN_SAMPLES:
+                failures = sum(1 for o, _ in stats.outcomes if o in self.FAILURES)
+                if failures / len(stats.outcomes) >= self.CIRCUIT_FAILURE_RATE:
+                    stats.open_until = time.time() + self.CIRCUIT_COOLDOWN
+                    logger.warning(f"Circuit opened for {domain}: {failures}/{len(stats.outcomes)} recent fetches failed")
+
+    @staticmethod
+    def _p95(latencies: List[float]) -> Optional[float]:
+        if not latencies:
+            return None
+        latencies = sorted(latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def timeout_for(self, domain: str, default: httpx.Timeout) -> httpx.Timeout:
+        """按该域名 p95 耗时的两倍收紧连接/读取超时，不超过默认值。"""
+        with self._lock:
+            stats = self._domains.get(domain)
+            latencies = [l for _, l in stats.outcomes if l is not None] if stats else []
+        if len(latencies) < self.MIN_SAMPLES:
+            return default
+        budget = 2 * self._p95(latencies)
+        return httpx.Timeout(
+            min(default.connect, max(self.MIN_CONNECT_TIMEOUT, budget)),
+            read=min(default.read, max(self.MIN_READ_TIMEOUT, budget)),
+            write=default.write,
+            pool=default.pool,
+        )
+
+    def retries_for(self, domain: str, default: int) -> int:
+        with self._lock:
+            stats = self._domains.get(domain)
+            outcomes = [o for o, _ in stats.outcomes] if stats else []
+        if len(outcomes) < self.MIN_SAMPLES:
+            return default
+        error_rate = outcomes.count('error') / len(outcomes)
+        return 1 if error_rate >= self.HIGH_ERROR_RATE else default
+
+    def snapshot(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """按样本数从多到少返回各域名的统计，供调试接口使用。"""
+        now = time.time()
+        with self._lock:
+            items = [(domain, list(stats.outcomes), stats.open_until) for domain, stats in self._domains.items()]
+        items.sort(key=lambda item: len(item[1]), reverse=True)
+        result = []
+        for domain, outcomes, open_until in items[:limit]:
+            total = len(outcomes)
+            names = [o for o, _ in outcomes]
+            p95 = self._p95([l for _, l in outcomes if l is not None])
+            result.append({
+                'domain': domain,
+                'samples': total,
+                'p95_latency': round(p95, 3) if p95 is not None else None,
+                'error_rate': round(names.count('error') / total, 3) if total else 0.0,
+                'extraction_failure_rate': round(names.count('extraction_failed') / total, 3) if total else 0.0,
+                'paywall_rate': round((names.count('paywall') + names.count('client_error')) / total, 3) if total else 0.0,
+                'circuit_open': open_until > now,
+                'circuit_open_until': open_until if open_until > now else None,
+            })
+        return result
+
+
+domain_health = DomainHealthTracker()
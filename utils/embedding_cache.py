@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = './cache/embeddings'
+
+
+class _ModelStore:
+    """
+    单个嵌入模型的向量存储。
+
+    vectors.f32 是按行追加的 float32 矩阵（通过 np.memmap 读取），index.txt 的第 i 行是
+    第 i 行向量对应文本的 sha256。先写向量再写索引，崩溃后以两者较短者为准。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.index_path = os.path.join(directory, 'index.txt')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = int(json.load(f)['dim'])
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                hashes = [line.strip() for line in f if line.strip()]
+            row_bytes = self.dim * 4
+            stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+            valid_rows = min(len(hashes), stored_rows)
+            if valid_rows < stored_rows:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(valid_rows * row_bytes)
+            if valid_rows < len(hashes):
+                with open(self.index_path, 'w', encoding='utf-8') as f:
+                    f.write(''.join(h + '\n' for h in hashes[:valid_rows]))
+            self.rows = {h: i for i, h in enumerate(hashes[:valid_rows])}
+            logger.info(f"Loaded {len(self.rows)} cached embeddings from {self.directory}")
+        except (OSError, ValueError, KeyError, json.JSONDecodeError) as e:
+            logger.warning(f"Embedding cache at {self.directory} is unreadable, starting empty: {e}")
+            self.clear()
+
+    def _mapped(self) -> Optional[np.memmap]:
+        if not self.rows or self.dim is None:
+            return None
+        if self._matrix is None or self._matrix.shape[0] < len(self.rows):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim))
+        return self._matrix
+
+    def get(self, text_hash: str) -> Optional[np.ndarray]:
+        row = self.rows.get(text_hash)
+        if row is None:
+            return None
+        matrix = self._mapped()
+        return np.array(matrix[row]) if matrix is not None else None
+
+    def append(self, hashes: Sequence[str], vectors: Sequence[Sequence[float]]):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(hashes):
+            return
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim}, f)
+        elif matrix.shape[1] != self.dim:
+            logger.warning(f"Embedding dimension changed ({self.dim} -> {matrix.shape[1]}), resetting cache at {self.directory}")
+            self.clear()
+            self.append(hashes, vectors)
+            return
+        with open(self.vectors_path, 'ab') as f:
+            f.write(matrix.tobytes())
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(h + '\n' for h in hashes))
+        start = len(self.rows)
+        for i, h in enumerate(hashes):
+            self.rows.setdefault(h, start + i)
+
+    def clear(self):
+        self._matrix = None
+        self.rows = {}
+        self.dim = None
+        for path in (self.vectors_path, self.index_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class EmbeddingCache:
+    """
+    以 (模型名, 文本sha256) 为键的持久化嵌入缓存，Similarity 与 Retrieval_v2 共用。
+    只把未命中的文本发送给嵌入接口，命中的向量以 float32 从内存映射矩阵读取。
+    """
+
+    MAX_ROWS_PER_MODEL = 500_000
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._stores: Dict[str, _ModelStore] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _store(self, model_name: str) -> _ModelStore:
+        store = self._stores.get(model_name)
+        if store is None:
+            safe_name = re.sub(r'[^A-Za-z0-9._-]+', '_', model_name)
+            store = _ModelStore(os.path.join(self.cache_dir, safe_name))
+            self._stores[model_name] = store
+        return store
+
+    def embed(self, model_name: str, texts: List[str], fetch: Callable[[List[str]], Optional[List[List[float]]]]) -> Optional[List[np.ndarray]]:
+        """
+        返回与 texts 一一对应的 float32 向量；未命中部分调用 fetch 获取并写入缓存。
+        fetch 失败时返回 None，与 _embed_batch_cloud 的失败语义一致。
+        """
+        hashes = [self._hash(text) for text in texts]
+        with self._lock:
+            store = self._store(model_name)
+            vectors: List[Optional[np.ndarray]] = [store.get(h) for h in hashes]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        self.stats['hits'] += len(texts) - len(missing)
+        self.stats['misses'] += len(missing)
+        if not missing:
+            return vectors  # type: ignore[return-value]
+
+        # 同一批次内重复的文本只请求一次
+        unique_missing: Dict[str, int] = {}
+        for i in missing:
+            unique_missing.setdefault(hashes[i], i)
+        fetched = fetch([texts[i] for i in unique_missing.values()])
+        if not fetched or len(fetched) != len(unique_missing):
+            return None
+
+        fetched_by_hash = {h: np.asarray(vec, dtype=np.float32) for h, vec in zip(unique_missing, fetched)}
+        for i in missing:
+            vectors[i] = fetched_by_hash[hashes[i]]
+        with self._lock:
+            store = self._store(model_name)
+            if len(store.rows) + len(fetched_by_hash) > self.MAX_ROWS_PER_MODEL:
+                logger.info(f"Embedding cache for '{model_name}' is full, clearing it")
+                store.clear()
+            new_hashes = [h for h in fetched_by_hash if h not in store.rows]
+            if new_hashes:
+                try:
+                    store.append(new_hashes, [fetched_by_hash[h] for h in new_hashes])
+                except OSError as e:
+                    logger.warning(f"Failed to persist embeddings: {e}")
+        return vectors  # type: ignore[return-value]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = sum(len(store.rows) for store in self._stores.values())
+        return {**self.stats, 'size': size}
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+from .config_manager import config
+
+logger = logging.getLogger(__name__)
+
+
+def _extract_in_worker(kind: str, body: bytes, url: str, options: Dict[str, Any]) -> str:
+    # 在子进程中执行，按需导入以免主进程循环导入
+    from .crawl_web import Crawl
+    if kind == 'pdf':
+        return Crawl._extract_pdf_content(body, url, **options)
+    return Crawl._parse_html_with_selectolax(body, url, **options)
+
+
+class ExtractionPool:
+    """
+    HTML/PDF 正文抽取的进程池。
+
+    抽取是纯 CPU 工作，在线程中执行会被 GIL 串行化；交给子进程后可以利用多核。
+    子进程只接收原始响应字节，返回清洗后的正文。进程数由 extraction_processes 配置，
+    0 表示关闭；小于 extraction_inline_bytes 的文档直接在当前线程抽取，省去进程间传输开销。
+    子进程崩溃或进程池关闭导致任务被取消时回退到线程内抽取，并在下次使用时重建进程池。
+    """
+
+    DEFAULT_INLINE_BYTES = 32 * 1024
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'offloaded': 0, 'inline': 0, 'failures': 0}
+
+    @staticmethod
+    def _configured_size() -> int:
+        default = min(4, (os.cpu_count() or 1) - 1)
+        try:
+            size = int(config.get('extraction_processes', default))
+        except (TypeError, ValueError):
+            size = default
+        return max(0, size)
+
+    @classmethod
+    def _inline_bytes(cls) -> int:
+        try:
+            return int(config.get('extraction_inline_bytes', cls.DEFAULT_INLINE_BYTES))
+        except (TypeError, ValueError):
+            return cls.DEFAULT_INLINE_BYTES
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        size = self._configured_size()
+        with self._lock:
+            if size != self._size and self._executor is not None:
+                # 其他线程已提交的抽取仍在旧进程池中执行完，不取消
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if size and self._executor is None:
+                # spawn 避免在多线程的服务进程中 fork
+                self._executor = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Extraction process pool started with {size} workers")
+            self._size = size
+            return self._executor
+
+    def extract(self, kind: str, body: bytes, url: str, inline: Callable[..., str], **options: Any) -> str:
+        """
+        kind: 'html' 或 'pdf'；inline 为线程内抽取函数，用于小文档和进程池不可用时。
+        options 原样传给抽取函数（如 PDF 选页用的 query）。
+        在工作线程中调用，会阻塞等待子进程结果。
+        """
+        executor = self._get_executor() if len(body) >= self._inline_bytes() else None
+        if executor is None:
+            self.stats['inline'] += 1
+            return inline(body, url, **options)
+        try:
+            future = executor.submit(_extract_in_worker, kind, body, url, options)
+        except RuntimeError:
+            # 取到进程池后它被其他线程因配置变化停用
+            self.stats['inline'] += 1
+            return inline(body, url, **options)
+        try:
+            result = future.result()
+            self.stats['offloaded'] += 1
+            return result
+        except (BrokenProcessPool, CancelledError) as e:
+            # CancelledError 是 BaseException，调用方的 except Exception 捕获不到，必须在这里回退
+            logger.error(f"Extraction process pool unavailable ({type(e).__name__}), extracting {url} in thread: {e}")
+            self.stats['failures'] += 1
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                    self._size = 0
+            return inline(body, url, **options)
+
+    def get_stats(self):
+        return {**self.stats, 'processes': self._size}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._size = 0
+
+
+extraction_pool = ExtractionPool()
@@ -0,0 +1,178 @@
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+from readability import Document
+from .charset import CharsetResolver
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLTree
+except ImportError:  # 旧版本 selectolax 没有 lexbor 后端
+    from selectolax.parser import HTMLParser as HTMLTree
+
+logger = logging.getLogger(__name__)
+
+# 整体去除的非正文标签
+BOILERPLATE_TAGS = [
+    'script', 'style', 'noscript', 'template', 'iframe', 'svg', 'canvas', 'nav', 'footer', 'header',
+    'aside', 'form', 'button', 'input', 'select', 'textarea', 'figure', 'img', 'video', 'audio', 'object',
+]
+# class/id 命中后整体去除的模板区块（评论、侧栏、分享、推荐等）
+BOILERPLATE_PATTERN = re.compile(
+    r'comment|sidebar|side-bar|footer|footnote|masthead|menu|nav|breadcrumb|share|social|related|recommend|'
+    r'advert|\bads?\b|sponsor|promo|popup|modal|cookie|subscribe|newsletter|login|banner|toolbar|pagination|copyright',
+    re.I,
+)
+# class/id 命中时加分的正文容器
+CONTENT_PATTERN = re.compile(r'article|content|entry|main|post|text|body|story|detail|正文', re.I)
+PARAGRAPH_TAGS = 'p, pre, blockquote, h2, h3'
+CONTAINER_TAGS = 'div, section, article, main, td, li'
+
+MIN_PARAGRAPH_CHARS = 25
+MIN_CONFIDENT_CHARS = 200
+MIN_CONFIDENT_SCORE = 10.0
+SIBLING_SCORE_RATIO = 0.2
+
+
+def decode_html(html_content: bytes, encoding: Optional[str] = None) -> str:
+    """encoding 通常由抓取时的 charset_resolver 确定；未给出时按 BOM、<meta charset>、UTF-8、统计检测的顺序确定。"""
+    return CharsetResolver.decode(html_content, encoding)
+
+
+def _paragraph_score(text: str) -> float:
+    commas = text.count(',') + text.count('，') + text.count('。') + text.count('、')
+    return 1 + commas + min(len(text) // 100, 3)
+
+
+def _class_weight(node) -> float:
+    attributes = node.attributes
+    marker = f"{attributes.get('class') or ''} {attributes.get('id') or ''}"
+    weight = 5.0 if node.tag in ('article', 'main') else 0.0
+    if marker.strip() and CONTENT_PATTERN.search(marker):
+        weight += 5.0
+    return weight
+
+
+def _remove_boilerplate(tree):
+    tree.strip_tags(BOILERPLATE_TAGS)
+    doomed = []
+    for node in tree.css('[class], [id], [role]'):
+        attributes = node.attributes
+        if node.tag in ('html', 'body', 'article', 'main'):
+            continue
+        marker = f"{attributes.get('class') or ''} {attributes.get('id') or ''}"
+        if attributes.get('role') in ('navigation', 'banner', 'complementary', 'contentinfo') or (
+                BOILERPLATE_PATTERN.search(marker) and not CONTENT_PATTERN.search(marker)):
+            doomed.append(node)
+    # css() 按文档顺序返回，倒序删除保证先删子节点，不会访问已随父节点释放的节点
+    for node in reversed(doomed):
+        node.decompose()
+
+
+def _score_candidates(tree) -> Dict[int, list]:
+    """
+    段落得分累加到父节点（祖父节点得一半），直接包含文本的容器本身也计分，
+    返回 mem_id -> [node, score]。
+    """
+    candidates: Dict[int, list] = {}
+
+    def add(node, score: float):
+        if node is None or node.tag in ('html', 'body'):
+            return
+        entry = candidates.get(node.mem_id)
+        if entry is None:
+            entry = candidates[node.mem_id] = [node, _class_weight(node)]
+        entry[1] += score
+
+    for node in tree.css(PARAGRAPH_TAGS):
+        text = node.text(strip=True)
+        if len(text) < MIN_PARAGRAPH_CHARS:
+            continue
+        score = _paragraph_score(text)
+        parent = node.parent
+        add(parent, score)
+        if parent is not None:
+            add(parent.parent, score / 2)
+    # 很多中文站点用 div + <br> 排版，没有 <p>，按容器自身的直接文本计分
+    for node in tree.css(CONTAINER_TAGS):
+        text = node.text(deep=False, strip=True)
+        if len(text) < MIN_PARAGRAPH_CHARS:
+            continue
+        score = _paragraph_score(text)
+        add(node, score)
+        add(node.parent, score / 2)
+    return candidates
+
+
+def _link_density(node, text_length: int) -> float:
+    if not text_length:
+        return 1.0
+    link_length = sum(len(a.text(strip=True)) for a in node.css('a'))
+    return min(1.0, link_length / text_length)
+
+
+def _best_candidate(candidates: Dict[int, list]) -> Tuple[Optional[object], float]:
+    best_node, best_score = None, 0.0
+    # 只对原始得分最高的几个候选计算链接密度
+    for node, score in sorted(candidates.values(), key=lambda item: item[1], reverse=True)[:5]:
+        text_length = len(node.text(strip=True))
+        adjusted = score * (1 - _link_density(node, text_length))
+        if adjusted > best_score:
+            best_node, best_score = node, adjusted
+    return best_node, best_score
+
+
+def _collect_text(best_node, best_score: float, candidates: Dict[int, list]) -> str:
+    """正文常被拆成多个相邻区块，同级且得分足够高的兄弟节点按文档顺序一并收入。"""
+    parent = best_node.parent
+    if parent is None:
+        return best_node.text(separator='\n')
+    threshold = max(MIN_CONFIDENT_SCORE, best_score * SIBLING_SCORE_RATIO)
+    parts: List[str] = []
+    for sibling in parent.iter():
+        if sibling.mem_id == best_node.mem_id:
+            parts.append(sibling.text(separator='\n'))
+            continue
+        entry = candidates.get(sibling.mem_id)
+        if entry and entry[1] >= threshold:
+            parts.append(sibling.text(separator='\n'))
+        elif sibling.tag == 'p' and len(sibling.text(strip=True)) >= 80:
+            parts.append(sibling.text(separator='\n'))
+    return '\n'.join(parts)
+
+
+def _readability_text(html: str) -> str:
+    summary_html = Document(html).summary(html_partial=True)
+    if not summary_html:
+        return ''
+    tree = HTMLTree(summary_html)
+    tree.strip_tags(BOILERPLATE_TAGS)
+    root = tree.body or tree.root
+    return root.text(separator='\n') if root is not None else ''
+
+
+def extract_main_text(html_content: bytes, url: str = '', encoding: Optional[str] = None) -> Tuple[str, str]:
+    """
+    单次解析抽取网页正文：去除模板区块后按段落密度为容器打分，取最佳容器及其同级正文块。
+    得分或正文长度不足（置信度低）时才回退到 readability，再不行取 body 全文。
+    返回 (正文, 使用的方法)，方法为 'selectolax' / 'readability' / 'body'。
+    """
+    html = decode_html(html_content, encoding)
+    tree = HTMLTree(html)
+    _remove_boilerplate(tree)
+    candidates = _score_candidates(tree)
+    best_node, best_score = _best_candidate(candidates)
+    text = _collect_text(best_node, best_score, candidates) if best_node is not None else ''
+    if best_score >= MIN_CONFIDENT_SCORE and len(text.strip()) >= MIN_CONFIDENT_CHARS:
+        return text, 'selectolax'
+
+    logger.info(f"Low extraction confidence for {url} (score {best_score:.1f}), falling back to readability")
+    try:
+        fallback = _readability_text(html)
+    except Exception as e:
+        logger.warning(f"Readability extraction failed for {url}: {e}")
+        fallback = ''
+    if len(fallback.strip()) >= max(len(text.strip()), 100):
+        return fallback, 'readability'
+    if text.strip():
+        return text, 'selectolax'
+    body = tree.body
+    return (body.text(separator='\n') if body is not None else ''), 'body'
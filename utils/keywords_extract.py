@@ -1,16 +1,136 @@
+import copy
+import hashlib
 import json
-from typing import List, Optional, Dict, Any
+import threading
+from typing import Callable, List, Optional, Dict, Any, Tuple
 import os
-from openai import OpenAI
+from cachetools import TTLCache
 import logging
 from datetime import date
 from .config_manager import config
+from .client_registry import clients
 
 logger = logging.getLogger(__name__)
 
-
-
-def keywords_extract(query: str,chat_history: List = []) -> Optional[Dict[str, Any]]:
+PLAN_CACHE_MAXSIZE = 1024
+PLAN_CACHE_TTL = 6 * 60 * 60  # seconds
+
+# 解析后的搜索计划缓存：TTL 过期 + LRU 淘汰，keywords_extract 在线程中运行，需加锁
+_plan_cache: TTLCache = TTLCache(maxsize=PLAN_CACHE_MAXSIZE, ttl=PLAN_CACHE_TTL)
+_plan_cache_lock = threading.Lock()
+_plan_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.split()).lower()
+
+
+def _plan_cache_key(query: str, chat_history: List, model_name: Optional[str], current_date: str) -> Tuple[str, str, str, str]:
+    """
+    缓存键：规范化查询、参与提示词的聊天记录哈希、模型名和当前日期（提示词中嵌入了 {current_date}）
+    """
+    history = [
+        [msg['role'], msg['content']] for msg in chat_history
+        if isinstance(msg, dict) and 'role' in msg and 'content' in msg
+    ]
+    history_hash = hashlib.sha256(json.dumps(history, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return normalize_query(query), history_hash, model_name or '', current_date
+
+
+def get_plan_cache_stats() -> Dict[str, Any]:
+    with _plan_cache_lock:
+        return {
+            'hits': _plan_cache_stats['hits'],
+            'misses': _plan_cache_stats['misses'],
+            'size': len(_plan_cache),
+            'maxsize': PLAN_CACHE_MAXSIZE,
+            'ttl': PLAN_CACHE_TTL,
+        }
+
+
+def clear_plan_cache():
+    with _plan_cache_lock:
+        _plan_cache.clear()
+
+
+class FoundationalQueryScanner:
+    """
+    增量扫描流式输出的搜索计划JSON，foundational_queries 数组中的每个对象一闭合就解析并回调，
+    不必等整个计划生成完毕。
+    """
+
+    KEY = '"foundational_queries"'
+
+    def __init__(self, on_query: Callable[[Dict[str, Any]], None]):
+        self.on_query = on_query
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'key'  # key -> array -> items -> done
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.item_start = -1
+
+    def feed(self, text: str):
+        self.buffer += text
+        if self.state == 'key':
+            index = self.buffer.find(self.KEY)
+            if index < 0:
+                return
+            self.state = 'array'
+            self.pos = index + len(self.KEY)
+        if self.state == 'array':
+            index = self.buffer.find('[', self.pos)
+            if index < 0:
+                return
+            self.state = 'items'
+            self.pos = index + 1
+        if self.state == 'items':
+            self._scan_items()
+
+    def _scan_items(self):
+        buffer = self.buffer
+        while self.pos < len(buffer):
+            char = buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._emit(buffer[self.item_start:self.pos + 1])
+            elif char == ']' and self.depth == 0:
+                self.state = 'done'
+                return
+            self.pos += 1
+
+    def _emit(self, raw: str):
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        if isinstance(item, dict) and item.get('query'):
+            try:
+                self.on_query(item)
+            except Exception as e:
+                logger.error(f"Error dispatching planned query {item}: {e}")
+
+
+def keywords_extract(query: str,chat_history: List = [], on_query: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+    """
+    生成搜索计划。传入 on_query 时以流式方式调用模型，每条 foundational_queries
+    一生成完就回调（在调用线程中执行），命中计划缓存时依次回调缓存中的查询。
+    """
     api_key=config.get("llm_api_key")
     base_url=config.get("llm_base_url")
     model_name=config.get("llm_model_name")
@@ -105,6 +225,21 @@ def keywords_extract(query: str,chat_history: List = []) -> Optional[Dict[str, A
 
 
     current_date = date.today().strftime("%Y-%m-%d")
+    cache_key = _plan_cache_key(query, chat_history, model_name, current_date)
+    with _plan_cache_lock:
+        cached_plan = _plan_cache.get(cache_key)
+        if cached_plan is not None:
+            _plan_cache_stats['hits'] += 1
+        else:
+            _plan_cache_stats['misses'] += 1
+    if cached_plan is not None:
+        logger.info(f"Search plan cache hit for query: {query}")
+        if on_query is not None:
+            for item in cached_plan.get('search_plan', {}).get('foundational_queries', []):
+                if isinstance(item, dict) and item.get('query'):
+                    on_query(dict(item))
+        return copy.deepcopy(cached_plan)
+
     system_message = {"role": "system", "content": final_prompt.format(current_date=current_date)}
     
     
@@ -121,28 +256,48 @@ def keywords_extract(query: str,chat_history: List = []) -> Optional[Dict[str, A
 
 
     logger.info(f'search_stage_prompt: {json.dumps(messages,ensure_ascii=False,indent=2)}')
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-    )
+    client = clients.get().llm_sync
+    if client is None:
+        logger.error("LLM configuration is missing.")
+        return None
     try:
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=0.3,
-            response_format={"type": "json_object"}
-        )
+        if on_query is None:
+            completion = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=0.3,
+                response_format={"type": "json_object"}
+            )
+            content = completion.choices[0].message.content
+        else:
+            scanner = FoundationalQueryScanner(on_query)
+            stream = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=0.3,
+                response_format={"type": "json_object"},
+                stream=True
+            )
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        scanner.feed(chunk.choices[0].delta.content)
+            finally:
+                stream.close()
+            content = scanner.buffer
 
       
-        if completion.choices[0].message.content.startswith('```json'):
-            json_content = completion.choices[0].message.content[len('```json'):-len('```')]
+        if content.startswith('```json'):
+            json_content = content[len('```json'):-len('```')]
         else:
-            json_content = completion.choices[0].message.content
+            json_content = content
 
 
         try:
             queries = json.loads(json_content)
             if isinstance(queries, dict) and queries:
+                with _plan_cache_lock:
+                    _plan_cache[cache_key] = copy.deepcopy(queries)
                 return queries
             else:
                 logger.error(f"Unexpected response format: {queries}")
@@ -0,0 +1,178 @@
+import asyncio
+import time
+import logging
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, TypeVar
+from .config_manager import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class LatencyBudget:
+    """
+    单次 /search 请求的时延预算。
+
+    持有一个总预算以及答案缓存查询、规划、搜索、抓取、检索、首token各阶段的分阶段预算，
+    每个阶段的实际超时取 min(阶段预算, 总预算剩余 - 首token预留)。阶段到期后以已有的部分结果继续：
+    已返回结果的搜索引擎、已抓取完成的网页、已完成的嵌入批次。
+    首token预算从总预算中预留（最多预留总预算的一半），前面的阶段再慢也不会挤占它，
+    因此 first_token 阶段至少有预留的时间，已有的部分结果总能生成回答。
+    """
+
+    STAGES = ('answer_cache', 'planning', 'search', 'crawl', 'retrieval', 'first_token')
+    DEFAULT_TOTAL_BUDGET = 45.0  # seconds
+    DEFAULT_STAGE_BUDGETS = {
+        'answer_cache': 3.0,
+        'planning': 10.0,
+        'search': 8.0,
+        'crawl': 12.0,
+        'retrieval': 8.0,
+        'first_token': 15.0,
+    }
+
+    def __init__(self, total_budget: float = DEFAULT_TOTAL_BUDGET, stage_budgets: Optional[Dict[str, float]] = None):
+        self.total_budget = total_budget
+        self.stage_budgets = dict(self.DEFAULT_STAGE_BUDGETS)
+        if stage_budgets:
+            self.stage_budgets.update(stage_budgets)
+        self.started_at = time.monotonic()
+        self.stage_elapsed: Dict[str, float] = {}
+        self.timed_out_stages: List[str] = []
+
+    @classmethod
+    def from_config(cls) -> 'LatencyBudget':
+        """
+        从 ConfigManager 读取预算，键为 latency_budget_total 与 latency_budget_<stage>，单位秒。
+        """
+        total_budget = cls._read_seconds('latency_budget_total', cls.DEFAULT_TOTAL_BUDGET)
+        stage_budgets = {
+            stage: cls._read_seconds(f'latency_budget_{stage}', default)
+            for stage, default in cls.DEFAULT_STAGE_BUDGETS.items()
+        }
+        return cls(total_budget, stage_budgets)
+
+    @staticmethod
+    def _read_seconds(key: str, default: float) -> float:
+        value = config.get(key)
+        if value in (None, ''):
+            return default
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid latency budget '{key}'={value!r}, using default {default}s")
+            return default
+        return seconds if seconds > 0 else default
+
+    def remaining(self) -> float:
+        return max(0.0, self.total_budget - (time.monotonic() - self.started_at))
+
+    def _first_token_reserve(self) -> float:
+        return min(self.stage_budgets.get('first_token', 0.0), self.total_budget / 2)
+
+    def stage_timeout(self, stage: str) -> float:
+        stage_budget = self.stage_budgets.get(stage, self.total_budget)
+        if stage == 'first_token':
+            # 预留部分一定可用，即使前面的阶段已把总预算用完
+            return min(stage_budget, max(self.remaining(), self._first_token_reserve()))
+        return min(stage_budget, max(0.0, self.remaining() - self._first_token_reserve()))
+
+    def _record(self, stage: str, started_at: float, timed_out: bool = False):
+        self.stage_elapsed[stage] = self.stage_elapsed.get(stage, 0.0) + time.monotonic() - started_at
+        if timed_out:
+            self.timed_out_stages.append(stage)
+            logger.warning(f"Stage '{stage}' exceeded its budget after {self.stage_elapsed[stage]:.2f}s")
+
+    async def run(self, stage: str, awaitable: Awaitable[T], default: Any = None) -> T:
+        """在阶段预算内等待 awaitable，超时返回 default。"""
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=self.stage_timeout(stage))
+        except asyncio.TimeoutError:
+            self._record(stage, started_at, timed_out=True)
+            return default
+        self._record(stage, started_at)
+        return result
+
+    async def gather(self, stage: str, awaitables: List[Awaitable[T]], default: Any = None) -> List[T]:
+        """
+        并发等待一组 awaitable，到期后取消仍未完成的部分，结果按输入顺序返回，未完成者为 default。
+        """
+        started_at = time.monotonic()
+        tasks = [asyncio.ensure_future(aw) for aw in awaitables]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=self.stage_timeout(stage))
+        for task in pending:
+            task.cancel()
+        self._record(stage, started_at, timed_out=bool(pending))
+
+        results = []
+        for task in tasks:
+            if task in done and not task.cancelled() and task.exception() is None:
+                results.append(task.result())
+            else:
+                if task in done and not task.cancelled():
+                    logger.error(f"Task in stage '{stage}' failed: {task.exception()}")
+                results.append(default)
+        return results
+
+    async def iterate(self, stage: str, source: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        逐项转发异步迭代器，阶段到期即停止迭代并关闭上游，下游只处理已到达的部分。
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.stage_timeout(stage)
+        iterator = source.__aiter__()
+        timed_out = False
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                try:
+                    item = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    break
+                yield item
+        finally:
+            self._record(stage, started_at, timed_out=timed_out)
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def first_token_within(self, source: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        要求首个chunk在 first_token 预算内到达，之后的chunk不再限时。
+        回答无法用部分结果代替，因此首token超时直接抛出 TimeoutError。
+        """
+        started_at = time.monotonic()
+        iterator = source.__aiter__()
+        try:
+            try:
+                first = await asyncio.wait_for(iterator.__anext__(), timeout=self.stage_timeout('first_token'))
+            except StopAsyncIteration:
+                self._record('first_token', started_at)
+                return
+            except asyncio.TimeoutError:
+                self._record('first_token', started_at, timed_out=True)
+                raise TimeoutError("等待模型首个token超时")
+            self._record('first_token', started_at)
+            yield first
+            async for item in iterator:
+                yield item
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'elapsed': round(time.monotonic() - self.started_at, 3),
+            'stages': {stage: round(elapsed, 3) for stage, elapsed in self.stage_elapsed.items()},
+            'timed_out': list(self.timed_out_stages),
+        }
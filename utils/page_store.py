@@ -0,0 +1,107 @@
+import time
+import zlib
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from .config_manager import config
+from . import database as db
+
+logger = logging.getLogger(__name__)
+
+
+# 只用于来源统计、不影响网页内容的查询参数
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'gbraid', 'wbraid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'spm', 'ref_src', 'share_source', 'share_medium', 'vd_source',
+}
+TRACKING_PREFIXES = ('utm_',)
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化URL作为存储键：scheme与host小写，去掉默认端口、片段和跟踪参数，其余查询参数按名称排序。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        netloc = f"{netloc}:{parts.port}"
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        # 只按参数名稳定排序，同名参数保持原有先后
+        query = urlencode(sorted(((k, v) for k, v in params if not _is_tracking_param(k)), key=lambda kv: kv[0]))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def page_identity(url: str) -> str:
+    """
+    判断两个URL是否为同一网页的键：在 canonicalize_url 基础上忽略 http/https 与 www. 前缀，
+    用于同一请求内多个查询返回的结果去重。
+    """
+    canonical = canonicalize_url(url)
+    identity = canonical.split('://', 1)[-1]
+    return identity[4:] if identity.startswith('www.') else identity
+
+
+class PageStore:
+    """
+    以规范化URL为键、存放在 cache_docker.db 中的已抓取网页存储。
+
+    保存抽取后的正文（zlib压缩）、ETag/Last-Modified 与抓取时间。抓取时间在
+    page_store_fresh_seconds 内的页面直接复用；超过后用条件GET重新验证，304 时复用。
+    总大小超过 page_store_max_bytes 后按最近访问时间淘汰。
+    """
+
+    DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+    DEFAULT_FRESH_SECONDS = 5 * 60
+    DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60  # 没有校验器的页面最长保留时间
+
+    @staticmethod
+    def _config_number(key: str, default: float) -> float:
+        try:
+            value = float(config.get(key, default))
+        except (TypeError, ValueError):
+            return default
+        return value if value > 0 else default
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        stored = db.get_page(url)
+        if stored is None:
+            return None
+        age = time.time() - stored['fetched_at']
+        if not (stored['etag'] or stored['last_modified']) and age > self._config_number('page_store_max_age_seconds', self.DEFAULT_MAX_AGE_SECONDS):
+            return None
+        try:
+            stored['content'] = zlib.decompress(stored['content']).decode('utf-8')
+        except (zlib.error, UnicodeDecodeError) as e:
+            logger.warning(f"Corrupted page store entry for {url}: {e}")
+            return None
+        return stored
+
+    def put(self, url: str, content: str, etag: Optional[str], last_modified: Optional[str]):
+        max_bytes = int(self._config_number('page_store_max_bytes', self.DEFAULT_MAX_BYTES))
+        db.save_page(url, zlib.compress(content.encode('utf-8'), 6), etag, last_modified, max_bytes)
+
+    def touch(self, url: str):
+        db.touch_page(url)
+
+    def is_fresh(self, stored: Dict[str, Any]) -> bool:
+        return time.time() - stored['fetched_at'] < self._config_number('page_store_fresh_seconds', self.DEFAULT_FRESH_SECONDS)
+
+    @staticmethod
+    def conditional_headers(stored: Dict[str, Any]) -> Dict[str, str]:
+        headers = {}
+        if stored.get('etag'):
+            headers['If-None-Match'] = stored['etag']
+        if stored.get('last_modified'):
+            headers['If-Modified-Since'] = stored['last_modified']
+        return headers
+
+
+page_store = PageStore()
@@ -1,18 +1,19 @@
+import asyncio
 import json
 import os
 import time
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 import jieba
 import numpy as np
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from scipy.special import softmax
 from rank_bm25 import BM25Okapi
 import logging
 from .config_manager import config
+from .client_registry import clients
+from .embedding_cache import embedding_cache
+from .latency_budget import LatencyBudget
 
 logger = logging.getLogger(__name__)
 
@@ -21,23 +22,20 @@ class Retrieval_v2:
 
         self.API_MAX_BATCH_SIZE = 10
         self.EMBEDDING_MAX_LENGTH = 1024
+        # 网页同时出现在其他查询的搜索结果中时，按其在那些查询中的排名倒数加分
+        self.CROSS_QUERY_WEIGHT = 0.1
         self.max_workers = min(self.API_MAX_BATCH_SIZE, (os.cpu_count() or 1) + 4)
         self.max_retries = 3
         self.request_timeout = 30  # seconds
-        self.session = requests.Session()
-        retries = Retry(
-            total=self.max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
-        self.session.headers.update({
-            "Authorization": f"Bearer {config.get('embedding_api_key')}",
-            "Content-Type": "application/json"
-        })
-
-
-    def _embed_batch_cloud(self, texts: List[str]) -> Optional[List[List[float]]]:
+        # 进程级共享会话，带重试与鉴权头，由 ClientRegistry 管理生命周期
+        self.session = clients.get().embedding_session
+
+
+    def _embed_batch_cloud(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        # 命中嵌入缓存的文本不再请求接口，只有未命中部分调用 _request_embeddings
+        return embedding_cache.embed(config.get('embedding_model_name') or '', texts, self._request_embeddings)
+
+    def _request_embeddings(self, texts: List[str]) -> Optional[List[List[float]]]:
         payload = {
             "model": config.get('embedding_model_name'),
             "input": texts,
@@ -57,6 +55,10 @@ class Retrieval_v2:
             logger.error(f"Cloud embedding batch failed: {e}")
             return None
 
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        embeddings = self._embed_batch_cloud([query])
+        return np.asarray(embeddings[0], dtype=np.float32) if embeddings else None
+
     def _embed_texts(self, texts: List[str]) -> List[Optional[np.ndarray]]:
         all_embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
         batches = [texts[i:i + self.API_MAX_BATCH_SIZE] for i in range(0, len(texts), self.API_MAX_BATCH_SIZE)]
@@ -71,16 +73,31 @@ class Retrieval_v2:
                 batch_embeddings = future.result()
                 if batch_embeddings:
                     for i, emb in enumerate(batch_embeddings):
-                        all_embeddings[start_index + i] = np.array(emb)
+                        all_embeddings[start_index + i] = np.asarray(emb, dtype=np.float32)
         return all_embeddings
 
     @staticmethod
-    def _cosine_similarity(v1: Optional[np.ndarray], v2: Optional[np.ndarray]) -> float:
-        if v1 is None or v2 is None: return 0.0
-        norm_v1 = np.linalg.norm(v1)
-        norm_v2 = np.linalg.norm(v2)
-        if norm_v1 == 0 or norm_v2 == 0: return 0.0
-        return np.dot(v1, v2) / (norm_v1 * norm_v2)
+    def _normalized_matrix(embeddings: List[Optional[np.ndarray]]) -> Optional[np.ndarray]:
+        """把向量堆叠成按行归一化的 float32 矩阵；缺失的向量对应全零行，相似度为 0"""
+        dim = next((len(emb) for emb in embeddings if emb is not None), 0)
+        if not dim:
+            return None
+        matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+        for i, emb in enumerate(embeddings):
+            if emb is not None and len(emb) == dim:
+                matrix[i] = emb
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    @classmethod
+    def _similarity_matrix(cls, page_embeddings: List[Optional[np.ndarray]], query_embeddings: List[Optional[np.ndarray]]) -> np.ndarray:
+        """一次矩阵乘法得到全部 网页×查询 的余弦相似度"""
+        pages = cls._normalized_matrix(page_embeddings)
+        queries = cls._normalized_matrix(query_embeddings)
+        if pages is None or queries is None or pages.shape[1] != queries.shape[1]:
+            return np.zeros((len(page_embeddings), len(query_embeddings)), dtype=np.float32)
+        return pages @ queries.T
 
     @staticmethod
     def _get_bm25_scores(query: str, corpus: List[str]) -> np.ndarray:
@@ -96,56 +113,172 @@ class Retrieval_v2:
         tokenized_query = list(jieba.cut(query))
         return bm25.get_scores(tokenized_query)
 
+    @staticmethod
+    def _get_top_k(search_plan_data: Dict[str, Any]) -> int:
+        complexity = search_plan_data.get('query_analysis', {}).get('assessed_complexity', '[Moderate]')
+        return 1 if complexity == '[Simple]' else 2
+
+    def _page_text_for_embedding(self, page: Dict) -> str:
+        return "Title: " + page.get('title', '') + " Content: " + page.get('content', '')[:self.EMBEDDING_MAX_LENGTH]
+
+    def _score_pages(self, query: str, pages: List[Dict], embedding_scores: np.ndarray, top_k: int) -> List[Dict]:
+        """embedding_scores: 各网页与查询的余弦相似度，来自 _similarity_matrix 的一列"""
+        contents_for_bm25 = ["Title: " + p.get('title', '') + " Content: " + p.get('content', '') for p in pages]
+        embedding_scores = embedding_scores.astype(np.float64)
+        logger.info("Calculating BM25 similarities...")
+        bm25_scores = self._get_bm25_scores(query, contents_for_bm25)
+        norm_embedding_scores = softmax(embedding_scores) if np.any(embedding_scores) else embedding_scores
+        norm_bm25_scores = softmax(bm25_scores) if np.any(bm25_scores) else bm25_scores
+        # logger.info(f'norm_embedding_scores: {norm_embedding_scores}')
+        # logger.info(f'norm_bm25_scores: {norm_bm25_scores}')
+
+        # query_ranks 由 Crawl 在多个查询返回同一网页时记录：{查询: 在该查询结果中的排名}
+        cross_query_scores = np.array([
+            sum(1.0 / (rank + 1) for other, rank in p.get('query_ranks', {}).items() if other != query and isinstance(rank, int))
+            for p in pages
+        ], dtype=np.float64)
+
+        combined_scores = norm_embedding_scores + 0.5*norm_bm25_scores + self.CROSS_QUERY_WEIGHT*cross_query_scores
+        for page, embedding_score, bm25_score, cross_query_score, combined_score in zip(pages, norm_embedding_scores.tolist(), norm_bm25_scores.tolist(), cross_query_scores.tolist(), combined_scores.tolist()):
+            page['embedding_score'] = embedding_score
+            page['bm25_score'] = bm25_score
+            page['cross_query_score'] = cross_query_score
+            page['combined_score'] = combined_score
+
+        # 稳定排序，得分相同时保持原顺序
+        order = np.argsort(-combined_scores, kind='stable')[:top_k]
+        sorted_pages = [pages[i] for i in order]
+        logger.info(f"Sorted pages: {json.dumps(sorted_pages,ensure_ascii=False,indent=2)}")
+        return sorted_pages
+
     def retrieve(self, search_plan_data: Dict[str, Any], search_results: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
         final_results = {}
-        complexity = search_plan_data.get('query_analysis', {}).get('assessed_complexity', '[Moderate]')
-        top_k = 1 if complexity == '[Simple]' else 2
+        top_k = self._get_top_k(search_plan_data)
         
         queries = list(search_results.keys())
         if not queries:
             return {}
 
-        logger.info("Embedding all unique queries...")
-        query_embeddings = self._embed_texts(queries)
-        query_embedding_map = {query: emb for query, emb in zip(queries, query_embeddings)}
+        # 所有查询与所有网页一次性分批并发嵌入，不再按查询串行请求；多个查询共有的网页只嵌入一次
+        all_pages = [page for pages in search_results.values() for page in pages]
+        page_texts = [self._page_text_for_embedding(p) for p in all_pages]
+        text_slots = {text: slot for slot, text in enumerate(dict.fromkeys(page_texts))}
+        logger.info(f"Embedding {len(queries)} queries and {len(text_slots)} unique pages...")
+        embeddings = self._embed_texts(queries + list(text_slots))
+        similarities = self._similarity_matrix(embeddings[len(queries):], embeddings[:len(queries)])
+        similarities = similarities[[text_slots[text] for text in page_texts]]
 
-        for query, pages in search_results.items():
+        offset = 0
+        for column, (query, pages) in enumerate(search_results.items()):
             if not pages:
                 final_results[query] = []
                 continue
 
             logger.info(f"Processing {len(pages)} pages for query: '{query}'")
-            contents_for_embedding = ["Title: " + p.get('title', '') + " Content: " + p.get('content', '')[:self.EMBEDDING_MAX_LENGTH] for p in pages]
-            contents_for_bm25 = ["Title: " + p.get('title', '') + " Content: " + p.get('content', '') for p in pages]
-            logger.info("Calculating embedding similarities...")
-            page_embeddings = self._embed_texts(contents_for_embedding)
-            query_emb = query_embedding_map.get(query)
-
-            embedding_scores = np.array([self._cosine_similarity(query_emb, page_emb) for page_emb in page_embeddings])
-            logger.info("Calculating BM25 similarities...")
-            bm25_scores = self._get_bm25_scores(query, contents_for_bm25)
-            norm_embedding_scores = softmax(embedding_scores) if np.any(embedding_scores) else embedding_scores
-            norm_bm25_scores = softmax(bm25_scores) if np.any(bm25_scores) else bm25_scores
-            # logger.info(f'norm_embedding_scores: {norm_embedding_scores}')
-            # logger.info(f'norm_bm25_scores: {norm_bm25_scores}')
-
-            combined_scores = norm_embedding_scores + 0.5*norm_bm25_scores
-            for i, page in enumerate(pages):
-                page['embedding_score'] = norm_embedding_scores[i]
-                page['bm25_score'] = norm_bm25_scores[i]
-                page['combined_score'] = combined_scores[i]
-
-            sorted_pages = sorted(pages, key=lambda x: x['combined_score'], reverse=True)
-            logger.info(f"Sorted pages: {json.dumps(sorted_pages,ensure_ascii=False,indent=2)}")
-            final_results[query] = sorted_pages[:top_k]
+            scores = similarities[offset:offset + len(pages), column]
+            offset += len(pages)
+            final_results[query] = self._score_pages(query, pages, scores, top_k)
             logger.info(f"Selected top {len(final_results[query])} pages for query '{query}'.")
 
         return final_results
 
+    async def retrieve_stream(self, search_plan_data: Dict[str, Any], queries: List[str], page_stream: AsyncIterator[Tuple[str, Dict]], budget: Optional[LatencyBudget] = None) -> Tuple[Dict[str, List[Dict]], Dict[str, List[Dict]]]:
+        """
+        流水线版本的 retrieve：查询向量在抓取开始时即并行计算，网页在到达后立即分批送去嵌入，
+        抓取结束后只剩 BM25 与打分。BM25 依赖整个语料的 IDF，因此仍在最后统一计算。
+
+        page_stream: 逐个产出 (query, page) 的异步迭代器，例如 Crawl.crawl_stream
+        budget: 可选的请求时延预算，抓取结束后等待嵌入的时间受 retrieval 阶段预算限制，
+                超时未返回的批次按无向量处理（仅用BM25打分）
+        返回 (检索结果, 按查询分组并按id排序的全部网页)
+        """
+        if not queries:
+            return {}, {}
+        top_k = self._get_top_k(search_plan_data)
+
+        logger.info("Embedding all unique queries while crawling...")
+        query_task = asyncio.create_task(asyncio.to_thread(self._embed_texts, queries))
+
+        arrived_pages: List[Dict] = []
+        page_indices: Dict[str, List[int]] = {query: [] for query in queries}
+        # 同一网页会分发给多个查询，按嵌入文本去重：page_slots[i] 为第 i 个网页对应的文本槽位
+        slot_texts: List[str] = []
+        text_slots: Dict[str, int] = {}
+        page_slots: List[int] = []
+        pending: List[int] = []
+        embed_tasks: List[Tuple[List[int], asyncio.Task]] = []
+
+        def flush():
+            if not pending:
+                return
+            slots = list(pending)
+            pending.clear()
+            texts = [slot_texts[slot] for slot in slots]
+            embed_tasks.append((slots, asyncio.create_task(asyncio.to_thread(self._embed_batch_cloud, texts))))
+
+        try:
+            async for query, page in page_stream:
+                arrived_pages.append(page)
+                page_indices.setdefault(query, []).append(len(arrived_pages) - 1)
+                text = self._page_text_for_embedding(page)
+                slot = text_slots.get(text)
+                if slot is None:
+                    slot = text_slots[text] = len(slot_texts)
+                    slot_texts.append(text)
+                    pending.append(slot)
+                page_slots.append(slot)
+                # 批次已满或当前没有在途请求时立即发送，保持嵌入接口持续工作
+                if len(pending) >= self.API_MAX_BATCH_SIZE or all(task.done() for _, task in embed_tasks):
+                    flush()
+            flush()
+
+            awaitables = [query_task] + [task for _, task in embed_tasks]
+            if budget is not None:
+                embedding_results = await budget.gather('retrieval', awaitables, default=None)
+            else:
+                embedding_results = await asyncio.gather(*awaitables)
+
+            query_embeddings = embedding_results[0] or [None] * len(queries)
+            slot_embeddings: List[Optional[np.ndarray]] = [None] * len(slot_texts)
+            for (slots, _), batch_embeddings in zip(embed_tasks, embedding_results[1:]):
+                if batch_embeddings:
+                    for slot, emb in zip(slots, batch_embeddings):
+                        slot_embeddings[slot] = np.asarray(emb, dtype=np.float32)
+        except BaseException:
+            query_task.cancel()
+            for _, task in embed_tasks:
+                task.cancel()
+            raise
+
+        for query in page_indices:
+            page_indices[query].sort(key=lambda i: arrived_pages[i]['id'])
+        web_pages = {query: [arrived_pages[i] for i in indices] for query, indices in page_indices.items()}
+
+        def _rank() -> Dict[str, List[Dict]]:
+            final_results = {}
+            # 抓取阶段才出现的查询没有查询向量，对应全零列
+            query_embedding_map = {query: emb for query, emb in zip(queries, query_embeddings)}
+            similarities = self._similarity_matrix(slot_embeddings, [query_embedding_map.get(query) for query in page_indices])
+            similarities = similarities[page_slots]
+            for column, (query, indices) in enumerate(page_indices.items()):
+                if not indices:
+                    final_results[query] = []
+                    continue
+                logger.info(f"Processing {len(indices)} pages for query: '{query}'")
+                final_results[query] = self._score_pages(
+                    query,
+                    [arrived_pages[i] for i in indices],
+                    similarities[indices, column],
+                    top_k,
+                )
+                logger.info(f"Selected top {len(final_results[query])} pages for query '{query}'.")
+            return final_results
+
+        return await asyncio.to_thread(_rank), web_pages
+
     def close(self):
-        if hasattr(self, 'session'):
-            self.session.close()
-            logger.info("HTTP session closed.")
+        # 会话由 ClientRegistry 共享持有，这里只释放引用
+        self.session = None
 
 
 if __name__ == '__main__':
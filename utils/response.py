@@ -1,11 +1,12 @@
+import asyncio
 import json
 from typing import List, Optional, Union, Dict, Any
 from langchain_core.documents import Document
-from openai import OpenAI
 import logging
 from datetime import date
 from openai.types.chat import ChatCompletionMessageParam
 from .config_manager import config
+from .client_registry import clients
 
 logger = logging.getLogger(__name__)
 
@@ -19,9 +20,10 @@ def generate(query, chat_history: Optional[List[dict]] = None):
     model_name = config.get("llm_model_name")
     api_key = config.get("llm_api_key")
 
-    if not all([base_url, model_name, api_key]):
+    llm_client = clients.get().llm
+    if not all([base_url, model_name, api_key]) or llm_client is None:
         logger.error("LLM configuration is missing.")
-        def error_stream():
+        async def error_stream():
             yield b"Error: LLM configuration is missing. Please configure the application."
         return error_stream()
     current_date ='当前日期：'+ date.today().strftime("%Y-%m-%d")
@@ -38,21 +40,18 @@ def generate(query, chat_history: Optional[List[dict]] = None):
     
     messages.append({"role": "user", "content": query})
     logger.info(f'response_stage_messages:{json.dumps(messages, ensure_ascii=False, indent=2)}')
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-        timeout=30  
-    )
+    client = llm_client.with_options(timeout=30)
 
     
-    def stream_generate():
+    async def stream_generate():
+        response = None
         try:
             logger.info("开始调用LLM API...")
             import time
             start_time = time.time()
             
             assert model_name is not None
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=model_name,
                 messages=messages,
                 stream=True,
@@ -63,22 +62,23 @@ def generate(query, chat_history: Optional[List[dict]] = None):
             logger.info(f"LLM API调用完成，耗时: {time.time() - start_time:.2f}秒")
             
             chunk_count = 0
-            for chunk in response:
+            async for chunk in response:
                 if chunk_count == 0:
                     logger.info(f"收到第一个chunk，总耗时: {time.time() - start_time:.2f}秒")
                 chunk_count += 1
-                
-                response_data = json.loads(chunk.model_dump_json())
-                try:
-                    content = response_data['choices'][0]['delta']['content']
-                    if content:  # 确保内容不为空
-                        yield f"{content}".encode('utf-8')  # 将内容逐块发送给客户端
-                except Exception as e:
-                    logger.error(f"Error extracting content from chunk: {e}")
+
+                if not chunk.choices:  # include_usage 的最后一个chunk没有choices
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:  # 确保内容不为空
+                    yield content.encode('utf-8')  # 将内容逐块发送给客户端
             
             logger.info(f"流式响应完成，总共处理了{chunk_count}个chunks")
         except Exception as e:
             logger.error(f"Error: {str(e)}")
+        finally:
+            if response is not None:
+                await response.close()  # 归还共享客户端的连接
 
     return stream_generate()
 
@@ -95,9 +95,10 @@ def search_generate(query: str, search_results: Union[Dict[str, List[Dict[str, A
     model_name = config.get("llm_model_name")
     api_key = config.get("llm_api_key")
 
-    if not all([base_url, model_name, api_key]):
+    llm_client = clients.get().llm
+    if not all([base_url, model_name, api_key]) or llm_client is None:
         logger.error("LLM configuration is missing.")
-        def error_stream():
+        async def error_stream():
             yield b"Error: LLM configuration is missing. Please configure the application."
         return error_stream()
 
@@ -177,15 +178,16 @@ def search_generate(query: str, search_results: Union[Dict[str, List[Dict[str, A
                 
     messages.append({"role": "user", "content": query})
     logger.info(f'response_stage_messages:{json.dumps(messages, ensure_ascii=False, indent=2)}')
-    client = OpenAI(api_key=api_key, base_url=base_url, timeout=60.0)
-    def stream_generate():
+    client = llm_client.with_options(timeout=60.0)
+    async def stream_generate():
+        response = None
         try:
             logger.info("开始调用LLM API (search_generate)...")
             import time
             start_time = time.time()
             
             assert model_name is not None
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=model_name,
                 messages=messages,
                 stream=True,
@@ -195,25 +197,23 @@ def search_generate(query: str, search_results: Union[Dict[str, List[Dict[str, A
             logger.info(f"LLM API调用完成 (search_generate)，耗时: {time.time() - start_time:.2f}秒")
             
             chunk_count = 0
-            for chunk in response:
+            async for chunk in response:
                 if chunk_count == 0:
                     logger.info(f"收到第一个chunk (search_generate)，总耗时: {time.time() - start_time:.2f}秒")
                 chunk_count += 1
-                
-                response_data = json.loads(chunk.model_dump_json())
-                try:
-                    content = response_data['choices'][0]['delta']['content']
-
-                    if content:  # 确保内容不为空
-                        yield f"{content}".encode('utf-8')  # 将内容逐块发送给客户端
-                except (KeyError, IndexError):
-                    pass # Ignore empty delta content
-                except Exception as e:
-                    logger.warning(f"Error extracting content from chunk: {e}")
+
+                if not chunk.choices:
+                    continue # Ignore chunks without choices
+                content = chunk.choices[0].delta.content
+                if content:  # 确保内容不为空
+                    yield content.encode('utf-8')  # 将内容逐块发送给客户端
             
             logger.info(f"流式响应完成 (search_generate)，总共处理了{chunk_count}个chunks")
         except Exception as e:
                 logger.error(f"Error: {str(e)}")
+        finally:
+            if response is not None:
+                await response.close()
 
     return stream_generate()
 
@@ -224,8 +224,10 @@ if __name__ == "__main__":
         search_results = json.load(f)
     with open('./cache/search_plan_data.json', 'r', encoding='utf-8') as f:
         search_plan_data = json.load(f)
-    result = search_generate(query, search_results=search_results, search_plan_data=search_plan_data, chat_history=[], debug=True)
-    for r in result:
-        print(r.decode('utf-8'))
+    async def main():
+        result = search_generate(query, search_results=search_results, search_plan_data=search_plan_data, chat_history=[], debug=True)
+        async for r in result:
+            print(r.decode('utf-8'))
+    asyncio.run(main())
 
 
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import json
+import threading
 import time
 from typing import List, Dict, Any, Optional, Tuple
 import jieba
 import numpy as np
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import chromadb
@@ -17,9 +17,12 @@ from langchain.retrievers.document_compressors.cross_encoder_rerank import Cross
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+from cachetools import TTLCache
 
 # Import the config manager
 from .config_manager import config
+from .client_registry import clients
+from .embedding_cache import embedding_cache
 
 logger = logging.getLogger(__name__)
 
@@ -78,21 +81,14 @@ class Similarity():
         self.max_retries = 3
         self.request_timeout = 30  # seconds
 
-        # Session for connection pooling and robust retries for cloud mode
-        self.session = requests.Session()
-        retries = Retry(
-            total=self.max_retries,
-            backoff_factor=1,  # Will sleep for {1, 2, 4} seconds between retries
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
-        self.session.headers.update({
-            "Authorization": f"Bearer {self.embedding_api_key}",
-            "Content-Type": "application/json"
-        })
-
-    # embed_documents 和 _embed_batch_cloud 方法保持不变
-    def _embed_batch_cloud(self, batch_of_texts: List[str]) -> Optional[List[List[float]]]:
+        # Process-wide session for connection pooling and robust retries, owned by ClientRegistry
+        self.session = clients.get().embedding_session
+
+    def _embed_batch_cloud(self, batch_of_texts: List[str]) -> Optional[List[np.ndarray]]:
+        """Embeds a batch of texts, sending only embedding-cache misses to the cloud API."""
+        return embedding_cache.embed(self.embedding_model_name, batch_of_texts, self._request_embeddings)
+
+    def _request_embeddings(self, batch_of_texts: List[str]) -> Optional[List[List[float]]]:
         """Embeds a batch of texts using the cloud API with retry logic."""
         payload = {
             "model": self.embedding_model_name,
@@ -120,7 +116,7 @@ class Similarity():
         texts_to_embed = [doc.page_content for doc in split_docs]
         batches = [texts_to_embed[i:i + self.batch_size] for i in range(0, len(texts_to_embed), self.batch_size)]
 
-        all_embeddings: List[Optional[List[float]]] = [None] * len(split_docs)
+        all_embeddings: List[Optional[np.ndarray]] = [None] * len(split_docs)
         logger.info(f"Starting cloud embedding for {len(split_docs)} documents in {len(batches)} batches...")
 
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
@@ -150,7 +146,7 @@ class Similarity():
         for i, vector in enumerate(all_embeddings):
             if vector is not None:
                 doc = split_docs[i]
-                results.append({'vector': vector, 'metadata': doc.metadata, 'page_content': doc.page_content})
+                results.append({'vector': vector.tolist(), 'metadata': doc.metadata, 'page_content': doc.page_content})
                 successful_count += 1
 
         logger.info(f"Embedding complete. Successfully embedded {successful_count}/{len(split_docs)} documents.")
@@ -300,6 +296,25 @@ class BM25():
         return bm25_results
 
 
+RERANK_CACHE_MAXSIZE = 50000
+RERANK_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# 重排分数缓存：键为 (rerank模型, 查询sha256, 文档sha256)
+_rerank_cache: TTLCache = TTLCache(maxsize=RERANK_CACHE_MAXSIZE, ttl=RERANK_CACHE_TTL)
+_rerank_cache_lock = threading.Lock()
+_rerank_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_rerank_cache_stats() -> Dict[str, Any]:
+    with _rerank_cache_lock:
+        size = len(_rerank_cache)
+    return {**_rerank_cache_stats, 'size': size, 'maxsize': RERANK_CACHE_MAXSIZE, 'ttl': RERANK_CACHE_TTL}
+
+
 class Rerank():
 
     def __init__(self):
@@ -313,17 +328,7 @@ class Rerank():
         self.max_retries = 3
         self.request_timeout = 30  # seconds
 
-        self.session = requests.Session()
-        retries = Retry(
-            total=self.max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
-        self.session.headers.update({
-            "Authorization": f"Bearer {self.rerank_api_key}",
-            "Content-Type": "application/json"
-        })
+        self.session = clients.get().rerank_session
 
     def _rerank_batch_cloud(self, documents: List[str], query: str, top_k: int) -> Optional[List[Dict]]:
         payload = {
@@ -346,24 +351,51 @@ class Rerank():
             return None
 
     def rerank_cloud(self, results: List[Document], query: str, k=10) -> List[Document]:
+        """
+        Reranks documents, reusing cached relevance scores per (model, query hash, document hash).
+        Only documents without a cached score are sent to the provider, and all of them are scored
+        (top_n = number of unseen documents) so cached and fresh scores can be merged before top-k selection.
+        """
         if not results:
             return []
 
         doc_contents = [doc.page_content for doc in results]
-
-        reranked_results = self._rerank_batch_cloud(doc_contents, query, top_k=k)
-
-        if reranked_results is None:
-            logger.warning("Reranking failed, returning original top-k results.")
-            return results[:k]
-
-        final_docs = []
-        for res in sorted(reranked_results, key=lambda x: x['relevance_score'], reverse=True):
-            original_index = res.get('index')
-            if original_index is not None and 0 <= original_index < len(results):
-                final_docs.append(results[original_index])
-
-        return final_docs[:k]
+        query_hash = _sha256(query)
+        keys = [(self.rerank_model_name, query_hash, _sha256(content)) for content in doc_contents]
+        with _rerank_cache_lock:
+            scores: List[Optional[float]] = [_rerank_cache.get(key) for key in keys]
+
+        unseen: Dict[Tuple, int] = {}
+        for i, score in enumerate(scores):
+            if score is None:
+                unseen.setdefault(keys[i], i)
+        _rerank_cache_stats['hits'] += len(scores) - sum(1 for score in scores if score is None)
+        _rerank_cache_stats['misses'] += len(unseen)
+
+        if unseen:
+            unseen_indices = list(unseen.values())
+            reranked_results = self._rerank_batch_cloud(
+                [doc_contents[i] for i in unseen_indices], query, top_k=len(unseen_indices)
+            )
+            if reranked_results is None:
+                logger.warning("Reranking failed, returning original top-k results.")
+                return results[:k]
+
+            fresh_scores = {}
+            for res in reranked_results:
+                batch_index = res.get('index')
+                if batch_index is not None and 0 <= batch_index < len(unseen_indices):
+                    fresh_scores[keys[unseen_indices[batch_index]]] = res['relevance_score']
+            with _rerank_cache_lock:
+                _rerank_cache.update(fresh_scores)
+            scores = [score if score is not None else fresh_scores.get(key) for score, key in zip(scores, keys)]
+
+        ranked_indices = sorted(
+            (i for i, score in enumerate(scores) if score is not None),
+            key=lambda i: scores[i],
+            reverse=True
+        )
+        return [results[i] for i in ranked_indices][:k]
 
 
 
@@ -1,17 +1,67 @@
 import asyncio
-from typing import List, Dict, Any, Optional
-import requests
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
 import random
+from collections import deque
 from baidusearch.baidusearch import search as baidu_search
 from duckduckgo_search import DDGS
-from .keywords_extract import keywords_extract
+from .keywords_extract import keywords_extract, normalize_query
 import json
 import time
 import logging
 from .config_manager import config
+from .client_registry import clients
+from .latency_budget import LatencyBudget
+from .crawl_web import Crawl
+from . import database as db
 
 logger = logging.getLogger(__name__)
 
+SEARCH_CACHE_TTL = 60 * 60  # seconds
+SEARCH_CACHE_MAX_ENTRIES = 5000
+SPECULATIVE_SIMILARITY = 0.6  # 规划查询与原始查询的字符二元组 Jaccard 相似度阈值
+HEDGE_PERCENTILE = 0.9
+HEDGE_DEFAULT_DELAY = 1.5  # 延迟样本不足时启动备用引擎前的等待时间（秒）
+HEDGE_MIN_RESULTS = 3
+HEDGE_MIN_SAMPLES = 10
+
+# 同一 (engine, query) 的并发未命中只发起一次引擎请求，其余调用者等待同一个任务
+_inflight_searches: Dict[Tuple[str, str], asyncio.Task] = {}
+_engine_cache_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+# 各引擎实际请求（不含缓存命中）的最近耗时，用于计算对冲搜索的等待阈值
+_engine_latencies: Dict[str, deque] = {}
+_hedge_stats = {'hedged': 0, 'backup_wins': 0}
+
+
+def _config_number(key: str, default: float) -> float:
+    try:
+        value = float(config.get(key, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+def get_engine_cache_stats() -> Dict[str, Any]:
+    return {
+        **_engine_cache_stats,
+        'ttl': _config_number('search_cache_ttl', SEARCH_CACHE_TTL),
+        'max_entries': int(_config_number('search_cache_max_entries', SEARCH_CACHE_MAX_ENTRIES)),
+        'hedging': {**_hedge_stats, 'delays': {engine: round(_hedge_delay(engine), 3) for engine in _engine_latencies}},
+    }
+
+
+def _record_engine_latency(engine: str, seconds: float):
+    _engine_latencies.setdefault(engine, deque(maxlen=200)).append(seconds)
+
+
+def _hedge_delay(engine: str) -> float:
+    """引擎耗时的 search_hedge_percentile 分位数，样本不足时使用 search_hedge_delay。"""
+    samples = sorted(_engine_latencies.get(engine, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return _config_number('search_hedge_delay', HEDGE_DEFAULT_DELAY)
+    percentile = min(_config_number('search_hedge_percentile', HEDGE_PERCENTILE), 1.0)
+    return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+
 class Search:
     def __init__(self):
         """
@@ -24,9 +74,45 @@ class Search:
         if not self.google_api_key or not self.google_cse_id or not self.google_enabled:
             logger.warning("Google Search is not configured or enabled. Google fallback/search will not work.")
             self.google_enabled = False # Ensure it's false if keys are missing
+        # 推测搜索结果被复用时仍在进行的预抓取，正式抓取等它写完页面存储再开始（见 Crawl.crawl_stream 的 after）
+        self.warm_task: Optional[asyncio.Task] = None
 
-    async def search_baidu(self, query: str) -> List[Dict[str, str]]:
-        """使用 asyncio.to_thread 异步执行同步的百度搜索"""
+    async def _cached_engine_call(self, engine: str, query: str, fetch: Callable[[], Awaitable[Optional[List[Dict[str, str]]]]]) -> Optional[List[Dict[str, str]]]:
+        """
+        以 (engine, 规范化查询) 为键读取 SQLite 结果缓存，未命中时调用 fetch 并写回。
+        只缓存非空结果；fetch 以独立任务运行，某个调用者被取消不会影响其他等待者和缓存写入。
+        """
+        key = (engine, normalize_query(query))
+        ttl = _config_number('search_cache_ttl', SEARCH_CACHE_TTL)
+        cached = await asyncio.to_thread(db.get_search_cache, engine, key[1], ttl)
+        if cached is not None:
+            _engine_cache_stats['hits'] += 1
+            logger.info(f"{engine}搜索缓存命中 '{query}'")
+            return cached
+
+        task = _inflight_searches.get(key)
+        if task is None:
+            _engine_cache_stats['misses'] += 1
+            task = asyncio.create_task(self._fetch_and_store(engine, key[1], fetch))
+            _inflight_searches[key] = task
+            task.add_done_callback(lambda _: _inflight_searches.pop(key, None))
+        else:
+            _engine_cache_stats['coalesced'] += 1
+            logger.info(f"{engine}搜索 '{query}' 已在进行中，等待其结果")
+        results = await asyncio.shield(task)
+        return [dict(item) for item in results] if results is not None else None
+
+    async def _fetch_and_store(self, engine: str, normalized_query: str, fetch: Callable[[], Awaitable[Optional[List[Dict[str, str]]]]]) -> Optional[List[Dict[str, str]]]:
+        started_at = time.monotonic()
+        results = await fetch()
+        _record_engine_latency(engine, time.monotonic() - started_at)
+        if results:
+            max_entries = int(_config_number('search_cache_max_entries', SEARCH_CACHE_MAX_ENTRIES))
+            await asyncio.to_thread(db.set_search_cache, engine, normalized_query, results, max_entries)
+        return results
+
+    async def search_baidu(self, query: str, fallback: bool = True) -> List[Dict[str, str]]:
+        """使用 asyncio.to_thread 异步执行同步的百度搜索，fallback 为 False 时失败不回退到Google"""
         def _search():
             try:
                 search_results = baidu_search(query) or []
@@ -42,19 +128,17 @@ class Search:
                     logger.error(f"Baidu搜索 '{query}' 时出错: {e}. 将返回空结果,如果需要搜索,请配置Google搜索。")
                 return []
                 
-        baidu_results = await asyncio.to_thread(_search)
-        if not baidu_results and self.google_enabled:
+        baidu_results = await self._cached_engine_call('baidu', query, lambda: asyncio.to_thread(_search))
+        if not baidu_results and self.google_enabled and fallback:
             logger.info(f"Baidu搜索失败，将回退到Google搜索")
             return await self.google_search(query)
         return baidu_results
 
-    async def search_duckduckgo(self, query: str, proxy: str | None = None) -> List[Dict[str, str]]:
+    async def search_duckduckgo(self, query: str, proxy: str | None = None, fallback: bool = True) -> List[Dict[str, str]]:
         """
         使用 asyncio.to_thread 异步执行同步的 DuckDuckGo 搜索。
-        增加了随机退避和失败后回退到Google搜索的机制。
+        增加了随机退避和失败后回退到Google搜索的机制（fallback 为 False 时不回退），命中结果缓存时不发起请求也不退避。
         """
-        await asyncio.sleep(random.uniform(0.1, 1.0))  # 随机延迟，模拟人类行为
-
         def _search():
             try:
                 with DDGS(proxy=proxy, timeout=5) as ddgs:
@@ -70,11 +154,15 @@ class Search:
                     logger.warning(f"DuckDuckGo搜索 '{query}' 时出错: {e}. 将返回空结果,如果需要搜索,请配置Google搜索。")
                 return None # 返回None以触发回退
         
-        ddg_results = await asyncio.to_thread(_search)
+        async def _fetch():
+            await asyncio.sleep(random.uniform(0.1, 1.0))  # 随机延迟，模拟人类行为
+            return await asyncio.to_thread(_search)
+
+        ddg_results = await self._cached_engine_call('duckduckgo', query, _fetch)
 
         if ddg_results is not None:
             return ddg_results
-        elif self.google_enabled:
+        elif self.google_enabled and fallback:
             return await self.google_search(query)
         else:
             return []
@@ -97,14 +185,14 @@ class Search:
                     "cx": final_cse_id,
                     "num": 10
                 }
-                response = requests.get(url, params=params, timeout=10)
+                response = clients.get().search_session.get(url, params=params, timeout=10)
                 response.raise_for_status()
                 return self.format_data_google(response.json())
             except Exception as e:
                 logger.error(f"Google搜索 '{query}' 时出错: {e}")
                 return []
 
-        return await asyncio.to_thread(_search)
+        return await self._cached_engine_call('google', query, lambda: asyncio.to_thread(_search)) or []
 
     def format_data_google(self, result: Dict) -> List[Dict]:
         """格式化Google搜索API返回的结果。"""
@@ -119,39 +207,184 @@ class Search:
             })
         return data
 
-    async def search(self, query: str, chat_history: List = [], proxy: str | None = None) -> tuple[Dict[str, Any] | None, Dict[str, List[Dict[str, str]]]]:
+    @staticmethod
+    def _query_similarity(a: str, b: str) -> float:
+        """规范化后字符二元组的 Jaccard 相似度，对中文查询同样适用。"""
+        a, b = normalize_query(a).replace(' ', ''), normalize_query(b).replace(' ', '')
+        if a == b:
+            return 1.0
+        grams_a = {a[i:i + 2] for i in range(len(a) - 1)} or {a}
+        grams_b = {b[i:i + 2] for i in range(len(b) - 1)} or {b}
+        return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+    def _engine_search(self, engine: str, query: str, proxy: str | None = None, fallback: bool = True) -> Awaitable[List[Dict[str, str]]]:
+        if engine == 'duckduckgo':
+            return self.search_duckduckgo(query, proxy=proxy, fallback=fallback)
+        if engine == 'google':
+            return self.google_search(query)
+        return self.search_baidu(query, fallback=fallback)
+
+    def _backup_engine(self, engine: str) -> Optional[str]:
+        if self.google_enabled and engine != 'google':
+            return 'google'
+        return 'duckduckgo' if engine == 'baidu' else 'baidu'
+
+    async def _hedged_search(self, engine: str, query: str, proxy: str | None = None) -> List[Dict[str, str]]:
+        """
+        对冲搜索：主引擎在其耗时分位数内未返回足够结果时启动备用引擎，
+        取先达到 search_hedge_min_results 条的结果并取消另一方；都不足时取条数较多者。
+        """
+        min_results = int(_config_number('search_hedge_min_results', HEDGE_MIN_RESULTS))
+        primary = asyncio.create_task(self._engine_search(engine, query, proxy, fallback=False))
+        tasks = [primary]
+        best: List[Dict[str, str]] = []
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=_hedge_delay(engine))
+            if primary in done and primary.exception() is None:
+                best = primary.result() or []
+                if len(best) >= min_results:
+                    return best
+            backup_engine = self._backup_engine(engine)
+            logger.info(f"{engine}搜索 '{query}' 未及时返回足够结果，启动备用引擎 {backup_engine}")
+            _hedge_stats['hedged'] += 1
+            backup = asyncio.create_task(self._engine_search(backup_engine, query, proxy, fallback=False))
+            tasks.append(backup)
+            pending = {task for task in tasks if not task.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        logger.error(f"对冲搜索 '{query}' 出错: {task.exception()}")
+                        continue
+                    results = task.result() or []
+                    if len(results) >= min_results:
+                        if task is backup:
+                            _hedge_stats['backup_wins'] += 1
+                        return results
+                    if len(results) > len(best):
+                        best = results
+            return best
+        finally:
+            # 底层引擎请求以独立任务运行，取消只是不再等待，完成后仍会写入结果缓存
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _warm_pages(self, query: str, search_task: asyncio.Task):
+        """抓取推测搜索的结果写入页面存储；推测结果未被复用时被取消，已完成的页面可被正式抓取复用。"""
+        results = await asyncio.shield(search_task)
+        if not results:
+            return
+        crawler = Crawl(async_client=clients.get().crawler)
+        page_stream = crawler.crawl_stream({query: [dict(item) for item in results]})
+        try:
+            async for _ in page_stream:
+                pass
+        except Exception as e:
+            logger.warning(f"推测抓取 '{query}' 时出错: {e}")
+        finally:
+            await page_stream.aclose()
+            await crawler.aclose()
+
+    async def _planned_search(self, engine: str, search_query: str, proxy: str | None = None) -> List[Dict[str, str]]:
+        if engine == 'baidu':
+            logger.info(f"Baidu搜索 '{search_query}'")
+        elif engine == 'duckduckgo':
+            logger.info(f"DuckDuckGo搜索 '{search_query}'")
+        else:
+            logger.info(f"不支持的搜索引擎 '{engine}'，将使用Baidu进行搜索。")
+            engine = 'baidu'
+        if str(config.get('search_hedging_enabled', 'false')).lower() == 'true':
+            return await self._hedged_search(engine, search_query, proxy)
+        return await self._engine_search(engine, search_query, proxy)
+
+    async def search(self, query: str, chat_history: List = [], proxy: str | None = None, budget: Optional[LatencyBudget] = None) -> tuple[Dict[str, Any] | None, Dict[str, List[Dict[str, str]]]]:
         """
         并发执行所有搜索任务。
         为DuckDuckGo任务传递代理参数。
+        传入 budget 时，规划与搜索分别受 planning / search 阶段预算限制：
+        规划超时视为无需搜索，搜索超时则只保留已返回结果的引擎。
+        规划以流式方式生成，每条基础查询一解析完成就发往对应引擎，不等待完整计划（search_plan_streaming 可关闭）。
+        开启 speculative_search_enabled 且没有聊天记录时，规划期间先用原始查询搜索并预抓取网页；
+        规划出的基础查询与原始查询足够相似时直接复用该搜索结果，预抓取继续进行并保存在 self.warm_task；
+        否则两者都取消。
         """
-        search_plan_data = keywords_extract(query, chat_history)
+        speculative_task = warm_task = None
+        if not chat_history and str(config.get('speculative_search_enabled', 'false')).lower() == 'true':
+            engine = str(config.get('speculative_search_engine', 'baidu')).lower()
+            logger.info(f"推测搜索: {engine} '{query}'")
+            speculative_task = asyncio.create_task(self._engine_search(engine, query, proxy))
+            warm_task = asyncio.create_task(self._warm_pages(query, speculative_task))
+
+        loop = asyncio.get_running_loop()
+        similarity_threshold = _config_number('speculative_search_similarity', SPECULATIVE_SIMILARITY)
+        dispatched: Dict[str, asyncio.Task] = {}
+        speculative_used = False
+        planning_open = True
+
+        def dispatch(item: Dict[str, Any]):
+            nonlocal speculative_used
+            search_query = item.get('query')
+            if not planning_open or not search_query or search_query in dispatched:
+                return
+            if speculative_task is not None and not speculative_used and self._query_similarity(query, search_query) >= similarity_threshold:
+                logger.info(f"复用原始查询的推测搜索结果 '{search_query}'")
+                speculative_used = True
+                dispatched[search_query] = speculative_task
+            else:
+                engine = str(item.get('engine') or 'baidu').lower()
+                dispatched[search_query] = asyncio.create_task(self._planned_search(engine, search_query, proxy))
+
+        def on_query(item: Dict[str, Any]):
+            # keywords_extract 在工作线程中回调，切回事件循环线程发起搜索
+            loop.call_soon_threadsafe(dispatch, item)
+
+        streaming = str(config.get('search_plan_streaming', 'true')).lower() == 'true'
+        try:
+            planning = asyncio.to_thread(keywords_extract, query, chat_history, on_query if streaming else None)
+            if budget is not None:
+                search_plan_data = await budget.run('planning', planning)
+            else:
+                search_plan_data = await planning
+        except BaseException:
+            if warm_task is not None:
+                warm_task.cancel()
+            raise
         logger.info(f"search_plan_data:{json.dumps(search_plan_data,ensure_ascii=False,indent=2)}")
         if not search_plan_data:
             logger.info(f'search_plan_data 为空')
+            planning_open = False
+            for task in dispatched.values():
+                task.cancel()
+            if speculative_task is not None:
+                speculative_task.cancel()
+                warm_task.cancel()
             return None, {"NO_SEARCH_NEEDED": []}
 
-        search_results = {}
+        # 以完整计划为准：补发流式解析中遗漏的查询，取消计划中不存在的查询
         foundational_queries = search_plan_data.get('search_plan', {}).get('foundational_queries', [])
-        tasks = []
         queries = []
-
         for item in foundational_queries:
-            search_query = item.get('query')
-            engine = item.get('engine', 'baidu').lower()
-            if not search_query:
-                continue
-            
-            queries.append(search_query)
-            if engine == 'baidu':
-                logger.info(f"Baidu搜索 '{search_query}'")
-                tasks.append(self.search_baidu(search_query))
-            elif engine == 'duckduckgo':
-                logger.info(f"DuckDuckGo搜索 '{search_query}'")
-                tasks.append(self.search_duckduckgo(search_query, proxy=proxy))
-            else:
-                logger.info(f"不支持的搜索引擎 '{engine}'，将使用Baidu进行搜索。")
-                tasks.append(self.search_baidu(search_query))
-        results_list = await asyncio.gather(*tasks)
+            if isinstance(item, dict) and item.get('query') and item['query'] not in queries:
+                dispatch(item)
+                queries.append(item['query'])
+        planning_open = False
+        for search_query, task in dispatched.items():
+            if search_query not in queries:
+                task.cancel()
+        if speculative_task is not None and not speculative_used:
+            logger.info(f"规划查询与原始查询差异较大，取消推测搜索")
+            speculative_task.cancel()
+            warm_task.cancel()
+        elif speculative_used:
+            self.warm_task = warm_task
+
+        tasks = [dispatched[q] for q in queries]
+        if budget is not None:
+            results_list = await budget.gather('search', tasks, default=[])
+        else:
+            results_list = await asyncio.gather(*tasks)
+        search_results = {}
         for q, r in zip(queries, results_list):
             search_results[q] = r
 
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.updated = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self):
+        # 换一个新的Event再唤醒旧的等待者，避免clear()与wait()之间的竞争
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+
+class StreamCoalescer:
+    """
+    相同键的并发流式请求只运行一次事件生成器，其余请求订阅同一事件序列。
+
+    生成器在独立的任务中运行，先到的请求断开不影响后到的请求；后到的请求会从头重放
+    已产生的事件。所有订阅者都离开后任务被取消，生成器结束后键立即释放。
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {'leaders': 0, 'followers': 0}
+
+    async def _run(self, key: str, flight: _Flight, source: AsyncIterator[Any]):
+        try:
+            async for event in source:
+                flight.events.append(event)
+                flight.publish()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.publish()
+
+    async def subscribe(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        订阅键对应的事件流；没有进行中的同键请求时调用 factory() 启动一个。
+        生成器抛出的异常会在每个订阅者处重新抛出。
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory()))
+            self.stats['leaders'] += 1
+        else:
+            self.stats['followers'] += 1
+            logger.info(f"Joining in-flight request for '{key}'")
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                updated = flight.updated
+                if index < len(flight.events):
+                    event = flight.events[index]
+                    index += 1
+                    yield event
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await updated.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, 'in_flight': len(self._flights)}
+
+
+search_coalescer = StreamCoalescer()